@@ -9,20 +9,35 @@ Noms et numéros étudiants:
 import argparse
 import getpass
 import json
+import os
 import socket
 import sys
 
+import glocache
 import glosocket
+import glotls
 import gloutils
 from tp4utils import BadChoice, BadPacket, ErrorResponse, castString
 
 from typing import Union
 
+def printNotification(message: gloutils.GloMessage) -> None:
+    payload = gloutils.NewMailPayload(message.get("payload"))
+    print(gloutils.NEW_MAIL_DISPLAY.format(
+        sender=payload.get("sender"),
+        subject=payload.get("subject"),
+        date=payload.get("date")
+    ))
+
 def getServerMessage(socket: socket.socket) -> gloutils.GloMessage:
 
     res = glosocket.recv_mesg(socket)
 
     message: gloutils.GloMessage = castString(res, gloutils.GloMessage)
+    # Une notification peut précéder la réponse attendue.
+    while message.get("header") == gloutils.Headers.NEW_MAIL:
+        printNotification(message)
+        message = castString(glosocket.recv_mesg(socket), gloutils.GloMessage)
     match message.get("header"):
         case gloutils.Headers.OK:
             return message
@@ -50,21 +65,55 @@ class Client:
     """Client pour le serveur mail @glo2000.ca 2025."""
 
     def __init__(self, destination: str) -> None:
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        """
+        Se connecte au serveur `destination` sur le port `GLO_PORT`
+        (`gloutils.APP_PORT` par défaut).
+
+        La connexion est chiffrée si `GLO_TLS` est défini, en vérifiant
+        le certificat du serveur avec les autorités du système, ou avec
+        le certificat `GLO_TLS_CA`.
+        """
         self._username: str = ""
+        self._destination = destination
+        self._cache: glocache.MailCache = None
+        self._port = int(os.environ.get("GLO_PORT", gloutils.APP_PORT))
+        self._tls = None
+        if os.environ.get("GLO_TLS") or os.environ.get("GLO_TLS_CA"):
+            self._tls = glotls.TLSConnector(
+                glotls.client_context(os.environ.get("GLO_TLS_CA")))
         try: 
-            host_ip = socket.gethostbyname(destination)
+            self._host_ip = socket.gethostbyname(destination)
         except socket.gaierror: 
             print("there was an error resolving the host")
             sys.exit(1) 
 
+        self._connect()
+        print(f"Connected to server {self._host_ip} with port {self._port}")
+
+    def _connect(self) -> None:
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
-            self._socket.connect((host_ip, gloutils.APP_PORT))
+            self._socket.connect((self._host_ip, self._port))
+            if self._tls is not None:
+                self._socket = self._tls.wrap(self._socket, self._destination,
+                                              self._port)
         except socket.error:
             print("Une erreur est survenue lors de la connexion au serveur.")
             exit(1)
-        print(f"Connected to server {host_ip} with port {gloutils.APP_PORT}")
+
+    def _reconnect(self) -> None:
+        """
+        Rétablit une connexion interrompue, par exemple lors du
+        redémarrage du serveur. Avec TLS, la session précédente est
+        reprise. L'utilisateur doit s'authentifier de nouveau.
+        """
+        if self._tls is not None:
+            self._tls.remember(self._socket, self._destination, self._port)
+        self._socket.close()
+        self._connect()
+        self._username = ""
+        print("Reconnecté au serveur, veuillez vous authentifier de nouveau.")
 
     
     def _authenticate(self, header: Union[gloutils.Headers.AUTH_LOGIN, gloutils.Headers.AUTH_REGISTER]):
@@ -84,6 +133,27 @@ class Client:
         getServerMessage(self._socket)
         
         self._username = username
+        self._cache = glocache.MailCache(self._destination, self._port, username)
+        self._subscribe()
+
+    def _subscribe(self) -> None:
+        """
+        S'abonne aux notifications de nouveaux courriels afin de ne pas
+        avoir à interroger la boîte de réception.
+        """
+        message = gloutils.GloMessage(
+            header=gloutils.Headers.INBOX_SUBSCRIBE
+        )
+
+        glosocket.send_mesg(self._socket, json.dumps(message))
+        getServerMessage(self._socket)
+
+    def _show_notifications(self) -> None:
+        """Affiche les notifications reçues depuis le dernier affichage."""
+        while glotls.readable(self._socket, 0):
+            message = castString(glosocket.recv_mesg(self._socket), gloutils.GloMessage)
+            if message.get("header") == gloutils.Headers.NEW_MAIL:
+                printNotification(message)
 
     def _register(self) -> None:
         self._authenticate(gloutils.Headers.AUTH_REGISTER)
@@ -103,37 +173,55 @@ class Client:
             print("Une erreur est survenue lors de la fermeture de la connexion avec le serveur.")            
 
 
-    def _read_email(self) -> None:
-        readMailMessage = gloutils.GloMessage(
-            header=gloutils.Headers.INBOX_READING_REQUEST
+    def _sync(self) -> None:
+        """
+        Met à jour le cache local en ne demandant au serveur que les
+        entêtes des courriels reçus et les identifiants des courriels
+        supprimés depuis la dernière synchronisation.
+        """
+        syncMessage = gloutils.GloMessage(
+            header=gloutils.Headers.INBOX_SYNC_REQUEST,
+            payload=gloutils.SyncPayload(since=self._cache.cursor)
         )
 
-        glosocket.send_mesg(self._socket, json.dumps(readMailMessage))
+        glosocket.send_mesg(self._socket, json.dumps(syncMessage))
         message = getServerMessage(self._socket)
-        mailRequestPayload = gloutils.EmailListPayload(message.get("payload"))
+        self._cache.apply_sync(gloutils.SyncResultPayload(message.get("payload")))
 
-        emailList = mailRequestPayload.get("email_list")
+    def _read_email(self) -> None:
+        self._sync()
+        emailIds = self._cache.email_ids
 
-        if emailList == None or emailList.__len__() == 0:
+        if len(emailIds) == 0:
             print("Vous n'avez pas encore reçu de mail.")
             return
 
-
-        for i, mailInfo in enumerate(mailRequestPayload.get("email_list")):
-            print(mailInfo)
-
-        choice = getChoice(emailList.__len__())
-
-        emailChoiceMessage = gloutils.GloMessage(
-            header=gloutils.Headers.INBOX_READING_CHOICE,
-            payload=gloutils.EmailChoicePayload(
-                choice=choice
+        for i, emailId in enumerate(emailIds, start=1):
+            summary = self._cache.summary(emailId)
+            print(gloutils.SUBJECT_DISPLAY.format(
+                number=i,
+                sender=summary.get("sender"),
+                subject=summary.get("subject"),
+                date=summary.get("date")
+            ))
+
+        choice = getChoice(len(emailIds))
+        emailId = emailIds[choice - 1]
+
+        # Un courriel déjà lu s'ouvre depuis le cache, sans aller-retour.
+        email = self._cache.get_email(emailId)
+        if email is None:
+            fetchMessage = gloutils.GloMessage(
+                header=gloutils.Headers.EMAIL_FETCH,
+                payload=gloutils.EmailIdPayload(
+                    email_id=emailId
+                )
             )
-        )
 
-        glosocket.send_mesg(self._socket, json.dumps(emailChoiceMessage))
-        message = getServerMessage(self._socket)
-        email = gloutils.EmailContentPayload(message.get("payload"))
+            glosocket.send_mesg(self._socket, json.dumps(fetchMessage))
+            message = getServerMessage(self._socket)
+            email = gloutils.EmailContentPayload(message.get("payload"))
+            self._cache.put_email(emailId, email)
 
         print(gloutils.EMAIL_DISPLAY.format(
             sender=email.get("sender"),
@@ -143,6 +231,19 @@ class Client:
             body=email.get("content")
         ))
 
+        if input("Supprimer ce courriel ? [o/N] ").lower() == "o":
+            deletionMessage = gloutils.GloMessage(
+                header=gloutils.Headers.EMAIL_DELETION,
+                payload=gloutils.EmailDeletionPayload(
+                    email_id=emailId
+                )
+            )
+
+            glosocket.send_mesg(self._socket, json.dumps(deletionMessage))
+            getServerMessage(self._socket)
+            self._cache.remove(emailId)
+            print("Courriel supprimé.")
+
     def _send_email(self) -> None:
         email = input("Entrez l'adresse du destinataire: ")
         subject = input("Entrez le sujet: ")
@@ -188,6 +289,45 @@ class Client:
             size=payload.get("size")
         ))
 
+    def _search_email(self) -> None:
+        print("Laissez vide les critères à ignorer.")
+        criteria = {
+            "sender": input("Expéditeur: "),
+            "subject": input("Mots du sujet: "),
+            "terms": input("Mots du contenu: "),
+            "date_from": input("Depuis le (AAAA-MM-JJ): "),
+            "date_to": input("Jusqu'au (AAAA-MM-JJ): ")
+        }
+        criteria = {key: value for key, value in criteria.items() if value}
+        if not criteria:
+            print("Aucun critère de recherche.")
+            return
+
+        page = 1
+        while True:
+            message = gloutils.GloMessage(
+                header=gloutils.Headers.INBOX_SEARCH_REQUEST,
+                payload=gloutils.SearchPayload(page=page, **criteria)
+            )
+
+            glosocket.send_mesg(self._socket, json.dumps(message))
+            res = getServerMessage(self._socket)
+            result = gloutils.SearchResultPayload(res.get("payload"))
+
+            emailList = result.get("email_list")
+            if not emailList:
+                print("Aucun courriel ne correspond à la recherche.")
+                return
+            for mailInfo in emailList:
+                print(mailInfo)
+
+            pageCount = result.get("page_count")
+            if page >= pageCount:
+                return
+            if input(f"Page {page}/{pageCount}, page suivante ? [o/N] ").lower() != "o":
+                return
+            page += 1
+
     def _logout(self) -> None:
         message = gloutils.GloMessage(
             header=gloutils.Headers.AUTH_LOGOUT
@@ -221,8 +361,9 @@ class Client:
                             should_quit = True
                     pass
                 else:
+                    self._show_notifications()
                     print(gloutils.CLIENT_USE_CHOICES)
-                    choice = getChoice(4)
+                    choice = getChoice(5)
                     match (choice):
                         case 1:
                             self._read_email()
@@ -231,6 +372,8 @@ class Client:
                         case 3:
                             self._check_stats()
                         case 4:
+                            self._search_email()
+                        case 5:
                             self._logout()
                     pass
             except ErrorResponse as e:
@@ -245,7 +388,7 @@ class Client:
                 print("Reponse invalide du serveur.")
             except glosocket.GLOSocketError:
                 print("Connexion avec le serveur interrompue.")
-                exit(1)
+                self._reconnect()
         self._quit()
 
 
@@ -6,18 +6,30 @@ Noms et numéros étudiants:
 -
 """
 
+import collections
 import hashlib
 import hmac
 import json
 import os
 import select
+import signal
 import socket
+import ssl
 import sys
 import re
 import time
 from datetime import datetime
+from typing import Callable, Iterator, NamedTuple, Optional
 
+import gloindex
+import glolimits
+import glohandoff
+import glometrics
+import gloreplication
 import glosocket
+import glostorage
+import glosweeper
+import glotls
 import gloutils
 
 from tp4utils import parse_packet, BadPacket
@@ -35,65 +47,680 @@ def create_ok_packet() -> gloutils.GloMessage:
     return create_packet(gloutils.Headers.OK)
 
 
+USERNAME_PATTERN = re.compile(r'^[A-Za-z0-9_.-]+$')
+PASSWORD_PATTERN = re.compile(r'^(?=.*[0-9])(?=.*[a-z])(?=.*[A-Z]).{10,}$')
+EMAIL_ID_PATTERN = re.compile(r'^[0-9]+$')
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+PRIMARY = "primary"
+STANDBY = "standby"
+
+
+class Route(NamedTuple):
+    """Entrée de la table de dispatch, construite au démarrage."""
+    name: str
+    handler: Callable[[socket.socket, Optional[dict]], gloutils.GloMessage]
+    requires_auth: bool
+    schema: Optional[dict[str, tuple[type, bool]]]
+
+
+def payload_schema(payload_type: type) -> dict[str, tuple[type, bool]]:
+    """
+    Extrait d'un gabarit *Payload le type de chaque champ et
+    s'il est obligatoire.
+    """
+    return {field: (field_type, field in payload_type.__required_keys__)
+            for field, field_type in payload_type.__annotations__.items()}
+
+
+def validate_payload(payload, schema: dict[str, tuple[type, bool]]) -> bool:
+    """
+    Vérifie que les champs du payload respectent le schéma. Un champ
+    facultatif peut être omis, mais pas valoir null; un booléen n'est
+    pas accepté comme entier.
+    """
+    if not isinstance(payload, dict):
+        return False
+    for field, (field_type, required) in schema.items():
+        if field not in payload and not required:
+            continue
+        value = payload.get(field)
+        if not isinstance(value, field_type) \
+                or (isinstance(value, bool) and field_type is not bool):
+            return False
+    return True
+
+
 class Server:
     """Serveur mail @glo2000.ca 2025."""
 
-    def __init__(self) -> None:
+    def __init__(self, port: Optional[int] = None,
+                 data_dir: Optional[str] = None) -> None:
         """
         Prépare le socket du serveur `_server_socket`
-        et le met en mode écoute.
+        et le met en mode écoute sur `port`, ou à défaut sur `GLO_PORT`
+        (`gloutils.APP_PORT` par défaut).
 
         Prépare les attributs suivants:
         - `_client_socs` une liste des sockets clients.
         - `_logged_users` un dictionnaire associant chaque
             socket client à un nom d'utilisateur.
-
-        S'assure que les dossiers de données du serveur existent.
+        - `_user_sockets` l'index inverse de `_logged_users`, associant
+            chaque nom d'utilisateur à ses sockets.
+        - `_subscribers` les sockets abonnés aux notifications NEW_MAIL.
+        - `_outboxes` les octets en attente d'envoi de chaque socket
+            que le client ne lit pas assez vite.
+        - `_parked` les requêtes en attente d'un index en construction,
+            reprises par la boucle une fois l'index prêt.
+
+        S'assure que les dossiers de données du serveur existent dans
+        `data_dir`, ou à défaut dans `GLO_DATA_DIR`
+        (`gloutils.SERVER_DATA_DIR` par défaut); tous les chemins sont
+        résolus par `_storage`.
+
+        L'instrumentation se configure par variables d'environnement:
+        - `GLO_LOG_LEVEL` le niveau de journalisation (INFO par défaut).
+        - `GLO_METRICS_PORT` le port local exposant `/metrics`
+            (`gloutils.METRICS_PORT` par défaut, 0 pour désactiver).
+        - `GLO_PROFILE` active le profileur échantillonneur, exposé
+            sur `/profile`.
+
+        Les limites se configurent de la même façon:
+        - `GLO_QUOTA_BYTES` l'espace maximal d'une boîte de réception
+            (`gloutils.USER_QUOTA_BYTES` par défaut, 0 pour désactiver).
+        - `GLO_MAX_MESSAGE_BYTES` la taille maximale d'un courriel
+            (`gloutils.MAX_MESSAGE_BYTES` par défaut, 0 pour désactiver).
+        - `GLO_LOST_QUOTA_BYTES` l'espace maximal du dossier LOST
+            (`gloutils.LOST_QUOTA_BYTES` par défaut, 0 pour désactiver).
+        - `GLO_CONNECTION_RATE_LIMIT` et `GLO_USER_RATE_LIMIT` les débits
+            de requêtes par connexion et par utilisateur, au format
+            `débit/rafale` (0 pour désactiver).
+        - `GLO_INDEX_CACHE_SIZE` le nombre d'index de recherche gardés en
+            mémoire (`gloutils.INDEX_CACHE_SIZE` par défaut); les moins
+            récemment utilisés sont évincés.
+        - `GLO_USAGE_CACHE_SIZE` le nombre de compteurs de boîte gardés en
+            mémoire (`gloutils.USAGE_CACHE_SIZE` par défaut), évincés de
+            la même façon.
+
+        Ainsi que la rétention, appliquée en arrière-plan par `_sweeper`:
+        - `GLO_EMAIL_RETENTION_DAYS` l'âge maximal des courriels
+            (`gloutils.EMAIL_RETENTION_DAYS` par défaut, 0 pour désactiver).
+        - `GLO_LOST_RETENTION_DAYS` l'âge maximal du dossier LOST
+            (`gloutils.LOST_RETENTION_DAYS` par défaut, 0 pour désactiver).
+        - `GLO_ARCHIVE_LOST` archive les courriels perdus expirés
+            plutôt que de les supprimer.
+        - `GLO_SWEEP_INTERVAL` le délai en secondes entre deux cycles.
+
+        Le signal SIGHUP déclenche un redémarrage sans interruption
+        (voir `_handoff`). Un serveur lancé ainsi reprend le socket
+        d'écoute, les connexions et les sessions de son prédécesseur.
+
+        La réplication se configure enfin par:
+        - `GLO_ROLE` le rôle du serveur: `primary` (par défaut) ou
+            `standby`. Une relève applique les mutations reçues de son
+            primaire et ne sert que les requêtes en lecture.
+        - `GLO_REPLICAS` les adresses `hôte:port` des relèves d'un
+            primaire, séparées par des virgules.
+        - `GLO_REPLICATION_SECRET` le secret partagé entre le primaire et
+            ses relèves, obligatoire des deux côtés: une relève refuse
+            tout flux de réplication qui ne le présente pas.
+
+        Le chiffrement TLS est activé par:
+        - `GLO_TLS_CERT` et `GLO_TLS_KEY` le certificat et la clé du
+            serveur. Les poignées de main s'effectuent sans bloquer la
+            boucle (voir `_continue_handshake`).
+        - `GLO_TLS_CA` le certificat de confiance pour joindre des
+            relèves qui utilisent TLS.
         """
+        self._logger = glometrics.configure_logging(
+            "glo.server", os.environ.get("GLO_LOG_LEVEL", "INFO"),
+            gloutils.LOG_FLUSH_INTERVAL)
+        self._handoff_state = glohandoff.read_state()
+        if port is None:
+            port = int(os.environ.get("GLO_PORT", gloutils.APP_PORT))
+        if data_dir is None:
+            data_dir = os.environ.get("GLO_DATA_DIR", gloutils.SERVER_DATA_DIR)
+        self._role = os.environ.get("GLO_ROLE", PRIMARY)
+        if self._role not in (PRIMARY, STANDBY):
+            self._logger.error("Unknown role %s", self._role)
+            glometrics.flush_logging(self._logger)
+            sys.exit(1)
+        self._tls = None
+        self._handshakes: dict[ssl.SSLSocket, tuple[float, bool]] = {}
+        if os.environ.get("GLO_TLS_CERT"):
+            try:
+                self._tls = glotls.server_context(os.environ["GLO_TLS_CERT"],
+                                                  os.environ.get("GLO_TLS_KEY"))
+            except (OSError, ssl.SSLError) as ex:
+                self._logger.error("Cannot load TLS certificate: %s", ex)
+                glometrics.flush_logging(self._logger)
+                sys.exit(1)
         try:
-            self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self._server_socket.bind(("127.0.0.1", gloutils.APP_PORT))
-            self._server_socket.listen()
-            print(f"Listening on port {gloutils.APP_PORT}")
+            if self._handoff_state is not None:
+                self._server_socket = socket.socket(
+                    fileno=self._handoff_state["listen_fd"])
+            else:
+                self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self._server_socket.bind(("127.0.0.1", port))
+                self._server_socket.listen()
+            self._logger.info("Listening on port %d%s",
+                              self._server_socket.getsockname()[1],
+                              " (TLS)" if self._tls is not None else "")
         except socket.error:
             sys.exit(1)
 
         self._client_socs: list[socket.socket] = []
         self._logged_users: dict[socket.socket, str] = {}
+        self._user_sockets: dict[str, set[socket.socket]] = {}
+        self._subscribers: set[socket.socket] = set()
+        self._outboxes: dict[socket.socket, bytearray] = {}
+        self._replication_sources: set[socket.socket] = set()
+        self._indexes: collections.OrderedDict[str, gloindex.MailboxIndex] = \
+            collections.OrderedDict()
+        self._index_cache_size = int(os.environ.get("GLO_INDEX_CACHE_SIZE",
+                                                    gloutils.INDEX_CACHE_SIZE))
+        self._index_builds: dict[str, Iterator[None]] = {}
+        self._parked: dict[socket.socket, tuple[Route, Optional[dict]]] = {}
+        self._usage: collections.OrderedDict[str, list[int]] = \
+            collections.OrderedDict()
+        self._usage_cache_size = int(os.environ.get("GLO_USAGE_CACHE_SIZE",
+                                                    gloutils.USAGE_CACHE_SIZE))
+        self._quota = int(os.environ.get("GLO_QUOTA_BYTES",
+                                         gloutils.USER_QUOTA_BYTES))
+        self._max_message = int(os.environ.get("GLO_MAX_MESSAGE_BYTES",
+                                               gloutils.MAX_MESSAGE_BYTES))
+        self._lost_quota = int(os.environ.get("GLO_LOST_QUOTA_BYTES",
+                                              gloutils.LOST_QUOTA_BYTES))
+        self._lost_usage: Optional[int] = None
+        self._connection_limiter = glolimits.RateLimiter(*glolimits.parse_rate(
+            os.environ.get("GLO_CONNECTION_RATE_LIMIT",
+                           gloutils.CONNECTION_RATE_LIMIT)))
+        self._user_limiter = glolimits.RateLimiter(*glolimits.parse_rate(
+            os.environ.get("GLO_USER_RATE_LIMIT", gloutils.USER_RATE_LIMIT)))
         self._queued_packets: dict[socket.socket, list[gloutils.GloMessage]] = {} 
+        self._storage = glostorage.Storage(data_dir)
         self.validate_directories()
+        self._setup_metrics()
+        self._setup_sweeper()
+        self._setup_replication()
+        self._routes = self._build_routes()
+        self._setup_reload()
+
+    def _setup_reload(self) -> None:
+        """
+        Installe le gestionnaire de SIGHUP et, si le serveur remplace
+        un prédécesseur, restaure ses sessions puis lui signale qu'il
+        est prêt.
+        """
+        self._reload_requested = False
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_w.setblocking(False)
+        if hasattr(signal, "SIGHUP"):
+            signal.set_wakeup_fd(self._wakeup_w.fileno())
+            signal.signal(signal.SIGHUP, self._request_reload)
+
+        state = self._handoff_state
+        if state is None:
+            return
+        self._storage.last_email_id = state.get("last_email_id", 0)
+        for client in state["clients"]:
+            client_soc = socket.socket(fileno=client["fd"])
+            self._client_socs.append(client_soc)
+            if client["username"] is not None:
+                self._bind_user(client_soc, client["username"])
+            if client["subscribed"]:
+                self._subscribers.add(client_soc)
+            if client["replication"]:
+                self._replication_sources.add(client_soc)
+        glohandoff.signal_ready(state)
+        self._logger.info("resumed %d connection(s) from previous process",
+                          len(state["clients"]))
+        glometrics.flush_logging(self._logger)
+        self._handoff_state = None
+
+    def _request_reload(self, *_) -> None:
+        self._reload_requested = True
+
+    def _handoff(self) -> bool:
+        """
+        Transmet le socket d'écoute, les connexions et les sessions à un
+        nouveau processus serveur. Appelée entre deux tours de boucle,
+        quand aucune requête n'est en cours: le processus cesse d'accepter
+        et de lire, puis se retire dès que son remplaçant est prêt.
+
+        Les connexions qui ne peuvent être transmises telles quelles (TLS,
+        file d'envoi entamée, requête en attente d'index, poignée de main
+        en cours) sont relayées par ce processus jusqu'à leur fermeture
+        (voir `_drain`): leurs clients ne se reconnectent pas.
+
+        Retourne False si le remplaçant n'a pas démarré; le serveur
+        continue alors de servir normalement.
+        """
+        self._reload_requested = False
+        clients = []
+        relayed: list[tuple[socket.socket, socket.socket, socket.socket]] = []
+        for client_soc in self._client_socs + list(self._handshakes):
+            client = {
+                "fd": client_soc.fileno(),
+                "username": self._logged_users.get(client_soc),
+                "subscribed": client_soc in self._subscribers,
+                "replication": client_soc in self._replication_sources
+            }
+            if isinstance(client_soc, ssl.SSLSocket) \
+                    or client_soc in self._outboxes or client_soc in self._parked:
+                local, remote = socket.socketpair()
+                relayed.append((client_soc, local, remote))
+                client["fd"] = remote.fileno()
+            clients.append(client)
+        state = {"listen_fd": self._server_socket.fileno(), "clients": clients,
+                 "metrics_fd": None, "last_email_id": self._storage.last_email_id}
+        fds = [self._server_socket.fileno()]
+        fds.extend(client["fd"] for client in clients)
+        if self._replicator is not None:
+            # Le remplaçant garde l'époque du journal: les relèves à jour
+            # n'ont pas à recevoir d'instantané.
+            try:
+                self._replicator.save(self._storage.replication_log_path)
+                state["replication_log"] = True
+            except OSError as ex:
+                self._logger.warning("cannot save replication log: %s", ex)
+        if self._metrics_socket is not None:
+            state["metrics_fd"] = self._metrics_socket.fileno()
+            fds.append(state["metrics_fd"])
+
+        self._logger.info("handing off %d connection(s), relaying %d connection(s)",
+                          len(clients), len(relayed))
+        glometrics.flush_logging(self._logger)
+        successor = glohandoff.spawn_successor(state, fds, gloutils.HANDOFF_TIMEOUT)
+        if successor is None:
+            for _, local, remote in relayed:
+                local.close()
+                remote.close()
+            self._logger.error("reload failed, still serving")
+            glometrics.flush_logging(self._logger)
+            return False
+
+        relays = []
+        for client_soc, local, remote in relayed:
+            remote.close()
+            to_local = b""
+            if client_soc in self._parked:
+                # La requête en attente est rejouée par le remplaçant.
+                route, payload = self._parked[client_soc]
+                to_local = glosocket.encode_mesg(json.dumps(create_packet(
+                    gloutils.Headers[route.name], payload)))
+            handshake = self._handshakes.pop(client_soc, None)
+            relays.append(glohandoff.Relay(
+                client_soc, local, bytes(self._outboxes.get(client_soc, b"")),
+                to_local, handshake[0] if handshake is not None else None))
+            if client_soc in self._client_socs:
+                self._client_socs.remove(client_soc)
+        # Le remplaçant détient maintenant ses propres copies des sockets:
+        # les fermer ici ne coupe aucune connexion.
+        self.cleanup()
+        self._drain(relays)
+        return True
+
+    def _drain(self, relays: list[glohandoff.Relay]) -> None:
+        """
+        Relaie les connexions confiées au remplaçant par une paire locale
+        jusqu'à leur fermeture, ou au plus `gloutils.HANDOFF_DRAIN_TIMEOUT`
+        secondes. Le processus n'accepte plus rien et ne touche plus au
+        stockage: le remplaçant sert toutes les requêtes.
+        """
+        if not relays:
+            return
+        self._logger.info("draining %d connection(s)", len(relays))
+        glometrics.flush_logging(self._logger)
+        deadline = time.monotonic() + gloutils.HANDOFF_DRAIN_TIMEOUT
+        while relays:
+            now = time.monotonic()
+            timeout = deadline - now
+            if timeout <= 0:
+                break
+            readers, writers = {}, {}
+            for relay in list(relays):
+                if relay.handshake_deadline is not None:
+                    if now >= relay.handshake_deadline:
+                        relay.close()
+                        relays.remove(relay)
+                        continue
+                    timeout = min(timeout, relay.handshake_deadline - now)
+                readers.update(dict.fromkeys(relay.readers(), relay))
+                writers.update(dict.fromkeys(relay.writers(), relay))
+            readable, writable, _ = select.select(readers, writers, [], timeout)
+            ready = {readers.get(sock) or writers[sock]
+                     for sock in readable + writable}
+            for relay in ready:
+                if not relay.pump():
+                    relay.close()
+                    relays.remove(relay)
+        for relay in relays:
+            relay.close()
+        self._logger.info("drained, exiting")
+        glometrics.flush_logging(self._logger)
+
+    def _setup_sweeper(self) -> None:
+        """Prépare le balayeur de rétention selon la configuration."""
+        self._sweeper = glosweeper.Sweeper(
+            self._storage,
+            glosweeper.RetentionPolicy(
+                # Une relève reçoit les expirations de son primaire.
+                email_days=float(os.environ.get(
+                    "GLO_EMAIL_RETENTION_DAYS", gloutils.EMAIL_RETENTION_DAYS))
+                if self._role == PRIMARY else 0,
+                lost_days=float(os.environ.get(
+                    "GLO_LOST_RETENTION_DAYS", gloutils.LOST_RETENTION_DAYS)),
+                archive_lost=bool(os.environ.get("GLO_ARCHIVE_LOST"))),
+            self._remove_email, self._indexes,
+            interval=float(os.environ.get("GLO_SWEEP_INTERVAL",
+                                          gloutils.SWEEP_INTERVAL)),
+            budget=gloutils.SWEEP_BUDGET,
+            max_delay=gloutils.SWEEP_MAX_DELAY,
+            on_swept=self._on_swept)
+
+    def _on_swept(self, kind: str, size: int) -> None:
+        self._swept.inc(label_value=kind)
+        if kind.startswith("lost_") and self._lost_usage is not None:
+            self._lost_usage = max(0, self._lost_usage - size)
+
+    def _setup_replication(self) -> None:
+        """
+        Prépare le journal de réplication d'un primaire ayant des relèves,
+        ou la position et les opérations applicables d'une relève.
+        """
+        self._replicator = None
+        self._replication_secret = os.environ.get("GLO_REPLICATION_SECRET", "")
+        replicas = [address for address in
+                    os.environ.get("GLO_REPLICAS", "").split(",") if address.strip()]
+        if self._role == PRIMARY and replicas:
+            if not self._replication_secret:
+                self._logger.error("GLO_REPLICAS requires GLO_REPLICATION_SECRET")
+                glometrics.flush_logging(self._logger)
+                sys.exit(1)
+            connector = None
+            if os.environ.get("GLO_TLS_CA"):
+                connector = glotls.TLSConnector(
+                    glotls.client_context(os.environ["GLO_TLS_CA"]))
+            self._replicator = gloreplication.Replicator(
+                self._storage, replicas, self._logger,
+                self._replication_secret, connector)
+            if self._handoff_state is not None \
+                    and self._handoff_state.get("replication_log"):
+                self._replicator.resume(self._storage.replication_log_path)
+            self._logger.info("Replicating to %s", ", ".join(replicas))
+        if self._role == STANDBY and not self._replication_secret:
+            self._logger.warning(
+                "No GLO_REPLICATION_SECRET, replication streams will be refused")
+        self._replication_position = gloreplication.load_position(
+            self._storage.replication_path)
+        self._replication_ops = {
+            "create_user": self._apply_create_user,
+            "deliver": self._apply_deliver,
+            "remove": self._apply_remove,
+            "mailbox": self._apply_mailbox,
+        }
+
+    def _build_routes(self) -> dict[int, Route]:
+        """
+        Construit la table de dispatch une seule fois: chaque entête est
+        associée à son traitement, à l'exigence d'authentification et au
+        schéma de son payload. Sur une relève, les requêtes qui modifient
+        les boîtes sont refusées.
+        """
+        headers = gloutils.Headers
+        routes = [
+            (headers.AUTH_REGISTER, self._create_account, False,
+             gloutils.AuthPayload),
+            (headers.AUTH_LOGIN, self._login, False, gloutils.AuthPayload),
+            (headers.AUTH_LOGOUT, lambda client, _: self._logout(client),
+             True, None),
+            (headers.INBOX_READING_REQUEST,
+             lambda client, _: self._get_email_list(client), True, None),
+            (headers.INBOX_READING_CHOICE, self._get_email, True,
+             gloutils.EmailChoicePayload),
+            (headers.EMAIL_SENDING,
+             lambda _, payload: self._send_email(payload), True,
+             gloutils.EmailContentPayload),
+            (headers.STATS_REQUEST,
+             lambda client, _: self._get_stats(client), True, None),
+            (headers.INBOX_SUBSCRIBE,
+             lambda client, _: self._subscribe(client), True, None),
+            (headers.INBOX_SEARCH_REQUEST, self._search_emails, True,
+             gloutils.SearchPayload),
+            (headers.EMAIL_DELETION, self._delete_email, True,
+             gloutils.EmailDeletionPayload),
+            (headers.INBOX_SYNC_REQUEST, self._sync_emails, True,
+             gloutils.SyncPayload),
+            (headers.EMAIL_FETCH, self._fetch_email, True,
+             gloutils.EmailIdPayload),
+            (headers.REPLICATION_HELLO, self._replication_hello, False,
+             gloutils.ReplicationHelloPayload),
+            (headers.REPLICATION_BATCH, self._replication_batch, False,
+             gloutils.ReplicationBatchPayload),
+        ]
+        if self._role == STANDBY:
+            mutating = (headers.AUTH_REGISTER, headers.EMAIL_SENDING,
+                        headers.EMAIL_DELETION)
+            routes = [(header, self._read_only, requires_auth, payload_type)
+                      if header in mutating else
+                      (header, handler, requires_auth, payload_type)
+                      for header, handler, requires_auth, payload_type in routes]
+        return {
+            int(header): Route(header.name, handler, requires_auth,
+                               payload_schema(payload_type)
+                               if payload_type is not None else None)
+            for header, handler, requires_auth, payload_type in routes
+        }
 
+    def _setup_metrics(self) -> None:
+        """Prépare les métriques, le point d'accès HTTP et le profileur."""
+        self._metrics = glometrics.MetricsRegistry()
+        self._request_latency = self._metrics.histogram(
+            "glo_request_duration_seconds",
+            "Durée de traitement des requêtes par entête.", "header")
+        self._storage_latency = self._metrics.histogram(
+            "glo_storage_duration_seconds",
+            "Durée des opérations de stockage.", "op")
+        self._bytes_in = self._metrics.counter(
+            "glo_received_bytes_total", "Octets reçus des clients.")
+        self._bytes_out = self._metrics.counter(
+            "glo_sent_bytes_total", "Octets envoyés aux clients.")
+        self._active_connections = self._metrics.gauge(
+            "glo_active_connections", "Connexions clientes ouvertes.")
+        self._logged_gauge = self._metrics.gauge(
+            "glo_logged_users", "Connexions authentifiées.")
+        self._push_sent = self._metrics.counter(
+            "glo_push_notifications_total", "Notifications NEW_MAIL envoyées.")
+        self._push_dropped = self._metrics.counter(
+            "glo_push_dropped_total",
+            "Notifications NEW_MAIL abandonnées, le client ne lisant plus.")
+        self._rejected = self._metrics.counter(
+            "glo_rejected_requests_total",
+            "Requêtes refusées par les limites.", "reason")
+        self._swept = self._metrics.counter(
+            "glo_swept_emails_total",
+            "Courriels traités par le balayeur de rétention.", "kind")
+        self._pending_requests = self._metrics.gauge(
+            "glo_pending_requests",
+            "Sockets prêts en attente de traitement dans la boucle.")
+        self._replication_lag_ops = self._metrics.gauge(
+            "glo_replication_lag_operations",
+            "Mutations du primaire pas encore confirmées par la relève.",
+            "replica")
+        self._replication_lag_seconds = self._metrics.gauge(
+            "glo_replication_lag_seconds",
+            "Âge de la plus ancienne mutation non confirmée par la relève.",
+            "replica")
+        self._tls_handshakes = self._metrics.counter(
+            "glo_tls_handshakes_total",
+            "Poignées de main TLS par issue: full, resumed ou failed.", "kind")
+        self._replication_applied = self._metrics.counter(
+            "glo_replication_applied_total",
+            "Mutations appliquées par la relève.")
+
+        self._profiler = None
+        if os.environ.get("GLO_PROFILE"):
+            self._profiler = glometrics.SamplingProfiler()
+            self._profiler.start()
+
+        self._metrics_socket = None
+        self._metrics_clients: dict[socket.socket, glometrics.HTTPConnection] = {}
+        if self._handoff_state is not None:
+            metrics_fd = self._handoff_state["metrics_fd"]
+            if metrics_fd is not None:
+                self._metrics_socket = socket.socket(fileno=metrics_fd)
+            return
+        metrics_port = int(os.environ.get("GLO_METRICS_PORT",
+                                          gloutils.METRICS_PORT))
+        if not metrics_port:
+            return
+        try:
+            self._metrics_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._metrics_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._metrics_socket.bind(("127.0.0.1", metrics_port))
+            self._metrics_socket.listen()
+            self._logger.info("Metrics on port %d", metrics_port)
+        except socket.error:
+            self._logger.warning("Metrics port %d unavailable", metrics_port)
+            self._metrics_socket.close()
+            self._metrics_socket = None
+        glometrics.flush_logging(self._logger)
+
+    def _serve_metrics(self) -> None:
+        """
+        Accepte une connexion au point d'accès des métriques. La requête
+        est lue et la réponse écrite par la boucle, sans bloquer.
+        """
+        metrics_soc, _ = self._metrics_socket.accept()
+        connection = glometrics.HTTPConnection(metrics_soc, time.monotonic())
+        self._metrics_clients[metrics_soc] = connection
+
+    def _metrics_routes(self) -> dict:
+        """Met à jour les jauges et retourne les chemins servis."""
+        self._active_connections.set(len(self._client_socs))
+        self._logged_gauge.set(len(self._logged_users))
+        if self._replicator is not None:
+            lags = self._replicator.lag(time.monotonic())
+            for address, (operations, seconds) in lags.items():
+                self._replication_lag_ops.set(operations, label_value=address)
+                self._replication_lag_seconds.set(seconds, label_value=address)
+        routes = {"/metrics": self._metrics.render}
+        if self._profiler is not None:
+            routes["/profile"] = self._profiler.render
+        return routes
+
+    def _continue_metrics(self, metrics_soc: socket.socket, writable: bool) -> None:
+        """Avance une connexion aux métriques; la ferme une fois servie."""
+        connection = self._metrics_clients[metrics_soc]
+        if writable:
+            keep = connection.on_writable()
+        else:
+            keep = connection.on_readable(self._metrics_routes)
+        if not keep:
+            del self._metrics_clients[metrics_soc]
+            metrics_soc.close()
+
+    def _expire_metrics(self, now: float) -> None:
+        """Ferme les connexions aux métriques restées inactives trop longtemps."""
+        for metrics_soc, connection in list(self._metrics_clients.items()):
+            if now >= connection.deadline:
+                del self._metrics_clients[metrics_soc]
+                metrics_soc.close()
 
     def validate_directories(self) -> None:
-        if not os.path.isdir(f"./{gloutils.SERVER_DATA_DIR}"):
-            os.mkdir(f"./{gloutils.SERVER_DATA_DIR}")
-        if not os.path.isdir(f"./{gloutils.SERVER_DATA_DIR}/{gloutils.SERVER_LOST_DIR}"):
-            os.mkdir(f"./{gloutils.SERVER_DATA_DIR}/{gloutils.SERVER_LOST_DIR}")
+        self._storage.validate()
 
     def cleanup(self) -> None:
         """Ferme toutes les connexions résiduelles."""
-        for client_soc in self._client_socs:
+        for client_soc in self._client_socs + list(self._handshakes):
             client_soc.close()
         self._server_socket.close()
+        for metrics_soc in self._metrics_clients:
+            metrics_soc.close()
+        if self._metrics_socket is not None:
+            self._metrics_socket.close()
+        if self._replicator is not None:
+            self._replicator.close()
+        if hasattr(signal, "SIGHUP"):
+            # Un signal tardif écrirait sinon dans un descripteur fermé,
+            # voire réattribué entre-temps.
+            signal.set_wakeup_fd(-1)
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+        if self._profiler is not None:
+            self._profiler.stop()
+        glometrics.flush_logging(self._logger)
 
     def _accept_client(self) -> None:
-        """Accepte un nouveau client."""
-        print("new client accepted")
+        """
+        Accepte un nouveau client. Avec TLS, la poignée de main se
+        poursuit dans la boucle et le client n'est servi qu'une fois
+        celle-ci terminée.
+        """
         new_soc, _ = self._server_socket.accept()
-        self._client_socs.append(new_soc)
+        self._logger.debug("new client accepted")
+        if self._tls is None:
+            self._client_socs.append(new_soc)
+            return
+        # Les enregistrements TLS de la poignée de main et les tickets de
+        # session sont de petites écritures successives: sans TCP_NODELAY,
+        # Nagle les retarde jusqu'à l'accusé différé du client.
+        new_soc.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        tls_soc = self._tls.wrap_socket(new_soc, server_side=True,
+                                        do_handshake_on_connect=False)
+        tls_soc.setblocking(False)
+        self._handshakes[tls_soc] = (
+            time.monotonic() + gloutils.TLS_HANDSHAKE_TIMEOUT, False)
+
+    def _continue_handshake(self, tls_soc: ssl.SSLSocket) -> None:
+        """
+        Avance la poignée de main d'un client sans bloquer. Le socket
+        reste dans `_handshakes`, avec l'événement attendu, tant qu'elle
+        n'est pas terminée.
+        """
+        deadline, _ = self._handshakes[tls_soc]
+        try:
+            tls_soc.do_handshake()
+        except ssl.SSLWantReadError:
+            self._handshakes[tls_soc] = (deadline, False)
+            return
+        except ssl.SSLWantWriteError:
+            self._handshakes[tls_soc] = (deadline, True)
+            return
+        except (ssl.SSLError, OSError) as ex:
+            self._logger.debug("TLS handshake failed: %s", ex)
+            self._tls_handshakes.inc(label_value="failed")
+            del self._handshakes[tls_soc]
+            tls_soc.close()
+            return
+        del self._handshakes[tls_soc]
+        tls_soc.setblocking(True)
+        self._tls_handshakes.inc(
+            label_value="resumed" if tls_soc.session_reused else "full")
+        self._client_socs.append(tls_soc)
+
+    def _expire_handshakes(self, now: float) -> None:
+        """Abandonne les poignées de main qui n'ont pas abouti à temps."""
+        for tls_soc, (deadline, _) in list(self._handshakes.items()):
+            if now >= deadline:
+                self._tls_handshakes.inc(label_value="failed")
+                del self._handshakes[tls_soc]
+                tls_soc.close()
 
     def _remove_client(self, client_soc: socket.socket) -> None:
         """Retire le client des structures de données et ferme sa connexion."""
         if client_soc in self._client_socs:
-            print("removing from client_socs")
             self._client_socs.remove(client_soc)
-        if client_soc in self._logged_users:
-            print("removing from logged_users")
-            self._logged_users.pop(client_soc)
+        self._unbind_user(client_soc)
+        self._replication_sources.discard(client_soc)
+        self._connection_limiter.forget(client_soc)
         if client_soc in self._queued_packets:
             self._queued_packets.pop(client_soc)
-        print("closing socket")
+        self._outboxes.pop(client_soc, None)
+        self._parked.pop(client_soc, None)
+        self._logger.debug("removing client")
         client_soc.close()
 
 
@@ -107,11 +734,13 @@ class Server:
         associe le socket au nouvel l'utilisateur et retourne un succès,
         sinon retourne un message d'erreur.
         """
-        print("Creating account")
+        self._logger.debug("creating account")
         error = {}
-        if not self._validate_username(payload['username']):
+        if USERNAME_PATTERN.fullmatch(payload['username']) is None:
             error['username_error'] = \
                 "Le nom d'utilisateur ne peut contenir que des  caractères alphanumériques, _, . ou -"
+        elif not self._validate_username(payload['username']):
+            error['username_error'] = "Ce nom d'utilisateur est réservé."
         if self._has_user_dir(payload['username']):
             error['username_error'] = \
                 "Le nom d'utilisateur est déjà utilisé"
@@ -121,65 +750,69 @@ class Server:
                 "contenir au moins un chiffre, une minuscule et une majuscule."
         if error:
             joined = "; ".join(error.values())
-            print(error)
-            print("error in account creation")
+            self._logger.debug("error in account creation: %s", error)
             return create_error_packet(joined)
 
         username = payload['username'].lower()
         self._create_user_dir(username)
-        self._hash_and_save_password(username, payload['password'])
-        self._logged_users[client_soc] = username
-        print("account creation successful")
+        password_hash = self._hash_and_save_password(username, payload['password'])
+        self._cache_usage(username, [0, 0])
+        if self._replicator is not None:
+            self._replicator.record(
+                gloreplication.create_user_op(username, password_hash))
+        self._bind_user(client_soc, username)
+        self._logger.info("account created: %s", username)
         return create_ok_packet()
 
     @staticmethod
     def _validate_username(username:str) -> bool:
-        pattern = re.compile(r'^[A-Za-z0-9_.-]+$')
-        return bool(pattern.fullmatch(username))
+        if USERNAME_PATTERN.fullmatch(username) is None:
+            return False
+        # Un nom fait de points désigne un dossier existant.
+        return username.strip(".") != ""
 
     @staticmethod
     def _validate_password_content(password:str) -> bool:
-        pattern = re.compile(r'^(?=.*[0-9])(?=.*[a-z])(?=.*[A-Z]).{10,}$')
-        return bool(pattern.fullmatch(password))
+        return PASSWORD_PATTERN.fullmatch(password) is not None
 
-    @staticmethod
-    def _create_user_dir(username:str) -> None:
-        os.mkdir(f"./{gloutils.SERVER_DATA_DIR}/{username}")
+    def _create_user_dir(self, username:str) -> None:
+        with self._storage_latency.time("mkdir"):
+            self._storage.create_user(username)
 
     def _has_user_dir(self, username: str) -> bool:
-        if username is None:
+        if username is None or not self._validate_username(username):
             return False
-        lower_username = username.lower()
-        path = os.path.join(f"./{gloutils.SERVER_DATA_DIR}", lower_username)
-        return os.path.isdir(path)
+        with self._storage_latency.time("lookup"):
+            return self._storage.has_user(username.lower())
 
 
-    def _list_user_emails(self, username: str) -> list[tuple[str, dict, float]]:
-        """Return list of (path, payload, mtime) for every email file in user's folder, sorted newest first."""
-        user_dir = f"./{gloutils.SERVER_DATA_DIR}/{username}"
+    def _list_user_emails(self, username: str,
+                          with_body: bool = True) -> list[tuple[str, dict, float]]:
+        """
+        Return list of (email_id, payload, mtime) for every email in user's folder, sorted newest first.
+        Without `with_body`, only the entries are read and payloads have no `content`.
+        """
         results: list[tuple[str, dict, float]] = []
-        if not os.path.isdir(user_dir):
-            return results
-        for fname in os.listdir(user_dir):
-            if fname == f"{gloutils.PASSWORD_FILENAME}.txt":
-                continue
-            full = os.path.join(user_dir, fname)
-            if not os.path.isfile(full):
-                continue
-            try:
-                with open(full, 'r', encoding='utf-8') as fh:
-                    payload = json.load(fh)
-                mtime = os.path.getmtime(full)
-                results.append((full, payload, mtime))
-            except (json.JSONDecodeError, OSError, ValueError):
-                continue
-        results.sort(key=lambda x: x[2], reverse=True)
+        with self._storage_latency.time("list"):
+            for email_id, full in self._storage.iter_emails(username):
+                try:
+                    payload, _ = self._storage.read_email(full, with_body)
+                    mtime = os.path.getmtime(full)
+                    results.append((email_id, payload, mtime))
+                except (json.JSONDecodeError, OSError, ValueError, KeyError):
+                    continue
+        results.sort(key=lambda x: (x[2], x[0]), reverse=True)
         return results
 
-    def _hash_and_save_password(self, username: str, password: str):
+    def _hash_and_save_password(self, username: str, password: str) -> str:
         password = self._hash_password(password)
-        with open(f"./{gloutils.SERVER_DATA_DIR}/{username}/{gloutils.PASSWORD_FILENAME}.txt", "w") as file:
-            file.write(password)
+        self._save_password_hash(username, password)
+        return password
+
+    def _save_password_hash(self, username: str, password_hash: str) -> None:
+        with self._storage_latency.time("write_password"), \
+                open(self._storage.password_path(username), "w") as file:
+            file.write(password_hash)
 
     @staticmethod
     def _hash_password(password: str):
@@ -194,45 +827,88 @@ class Server:
         Si les identifiants sont valides, associe le socket à l'utilisateur et
         retourne un succès, sinon retourne un message d'erreur.
         """
-        print("user loggin in")
         error = {}
         username = payload.get("username")
         if not self._has_user_dir(payload['username']):
             error['username_error'] = "Le nom d'utilisateur n'existe pas"
-            print("login error")
+            self._logger.debug("login error: unknown user")
             return create_error_packet(error['username_error'])
         username = username.lower()
         if not self._validate_password(username, payload['password']):
             error['password_error'] = "Mauvais mot de passe"
-            print("login error")
+            self._logger.debug("login error: bad password for %s", username)
             return create_error_packet(error['password_error'])
-        self._logged_users[client_soc] = username
-        print("login successful")
+        self._bind_user(client_soc, username)
+        self._logger.debug("login successful: %s", username)
         return create_ok_packet()
 
     def _validate_password(self, username: str, password: str) -> bool:
         password = self._hash_password(password)
-        with open(f"{gloutils.SERVER_DATA_DIR}/{username}/{gloutils.PASSWORD_FILENAME}.txt", "r") as file:
-            stored_password = file.read().strip()
+        try:
+            with self._storage_latency.time("read_password"), \
+                    open(self._storage.password_path(username), "r") as file:
+                stored_password = file.read().strip()
+        except OSError:
+            # Un ancien compte migré peut n'avoir aucun mot de passe.
+            return False
         return password == stored_password
 
     def _logout(self, client_soc: socket.socket) -> None:
         """Déconnecte un utilisateur."""
-        if client_soc in self._logged_users:
-            self._logged_users.pop(client_soc)
+        self._unbind_user(client_soc)
         return create_ok_packet()
 
+    def _bind_user(self, client_soc: socket.socket, username: str) -> None:
+        """Associe le socket à l'utilisateur dans les deux index."""
+        self._logged_users[client_soc] = username
+        self._user_sockets.setdefault(username, set()).add(client_soc)
 
-    def _get_email_list(self, client_soc: socket.socket) -> gloutils.GloMessage:
-        username = self._logged_users[client_soc]
-        user_dir = f"./{gloutils.SERVER_DATA_DIR}/{username}"
-        if not os.path.isdir(user_dir):
-            payload = gloutils.EmailListPayload(email_list=[])
-            return create_packet(gloutils.Headers.OK, payload)
+    def _unbind_user(self, client_soc: socket.socket) -> None:
+        """Retire le socket des index d'utilisateurs et des abonnés."""
+        self._subscribers.discard(client_soc)
+        username = self._logged_users.pop(client_soc, None)
+        if username is None:
+            return
+        sockets = self._user_sockets.get(username)
+        if sockets is not None:
+            sockets.discard(client_soc)
+            if not sockets:
+                del self._user_sockets[username]
+
+    def _subscribe(self, client_soc: socket.socket) -> gloutils.GloMessage:
+        """
+        Abonne le socket aux notifications NEW_MAIL: chaque courriel livré
+        à l'utilisateur lui est signalé sans qu'il ait à relire sa boîte.
+        """
+        self._subscribers.add(client_soc)
+        return create_ok_packet()
 
-        email_files = self._list_user_emails(username)
+    def _notify_new_mail(self, username: str,
+                         payload: gloutils.EmailContentPayload) -> None:
+        """Pousse une notification NEW_MAIL aux sockets abonnés du destinataire."""
+        sockets = self._user_sockets.get(username)
+        if not sockets:
+            return
+        notification = create_packet(gloutils.Headers.NEW_MAIL, gloutils.NewMailPayload(
+            sender=payload['sender'],
+            subject=payload['subject'][:gloutils.NEW_MAIL_SUBJECT_LENGTH],
+            date=payload['date']
+        ))
+        for client_soc in list(sockets):
+            if client_soc not in self._subscribers:
+                continue
+            # Un abonné qui ne lit plus ne retient pas la boucle: une fois
+            # sa file pleine, ses notifications sont abandonnées.
+            if len(self._outboxes.get(client_soc, b"")) >= gloutils.OUTBOX_MAX_BYTES:
+                self._push_dropped.inc()
+                continue
+            self._queue_packet(client_soc, notification)
+            self._push_sent.inc()
 
-        email_files.sort(key=lambda x: x[2], reverse=True)
+
+    def _get_email_list(self, client_soc: socket.socket) -> gloutils.GloMessage:
+        username = self._logged_users[client_soc]
+        email_files = self._list_user_emails(username, with_body=False)
 
         email_list = []
         for i, (path, payload, mtime) in enumerate(email_files, start=1):
@@ -261,28 +937,285 @@ class Server:
         Récupère le contenu de l'email dans le dossier de l'utilisateur associé
         au socket.
         """
-        username = self._logged_users[client_soc]
+        chosen = self._get_chosen_email(client_soc, payload)
+        if chosen is None:
+            return create_error_packet("Choix invalide.")
+        email_id, _, _ = chosen
+        return self._read_email(self._logged_users[client_soc], email_id)
 
-        email_files = self._list_user_emails(username)
+    def _get_chosen_email(
+        self, client_soc: socket.socket, payload: gloutils.EmailChoicePayload
+    ) -> Optional[tuple[str, dict, float]]:
+        """Retourne le courriel désigné par son numéro dans la boîte, ou None."""
+        username = self._logged_users[client_soc]
 
-        email_files.sort(key=lambda x: x[2], reverse=True)
+        email_files = self._list_user_emails(username, with_body=False)
 
         choice = None
         try:
             choice = int(payload.get('choice'))
         except (TypeError, ValueError):
-            return create_error_packet("Choix invalide.")
+            return None
 
         if choice < 1 or choice > len(email_files):
-            return create_error_packet("Choix invalide.")
+            return None
+
+        return email_files[choice-1]
+
+    def _delete_email(
+        self, client_soc: socket.socket, payload: gloutils.EmailDeletionPayload
+    ) -> gloutils.GloMessage:
+        """
+        Supprime le courriel désigné par son identifiant ou par son numéro
+        dans la boîte de l'utilisateur associé au socket.
+        """
+        username = self._logged_users[client_soc]
+        email_id = payload.get('email_id')
+        if email_id is None:
+            chosen = self._get_chosen_email(client_soc, payload)
+            if chosen is None:
+                return create_error_packet("Choix invalide.")
+            email_id, _, _ = chosen
+        elif EMAIL_ID_PATTERN.fullmatch(email_id) is None:
+            return create_error_packet("Courriel introuvable.")
+        try:
+            self._remove_email(username, email_id,
+                               self._storage.email_path(username, email_id))
+        except OSError:
+            return create_error_packet("Impossible de supprimer le courriel.")
+        return create_ok_packet()
+
+    def _sync_emails(
+        self, client_soc: socket.socket, payload: gloutils.SyncPayload
+    ) -> gloutils.GloMessage:
+        """
+        Synchronise le cache d'un client: retourne les entêtes des
+        courriels reçus et les identifiants des courriels supprimés depuis
+        le curseur, sans parcourir la boîte. Attend, comme la recherche,
+        que l'index de l'utilisateur soit construit.
+
+        Le curseur `<id>:<génération>:<position>` combine le plus grand
+        identifiant connu, qui ne recule jamais, et la position atteinte
+        dans le journal des suppressions. Si ce journal a été recommencé
+        depuis, la réponse est une resynchronisation complète (`reset`).
+        """
+        username = self._logged_users[client_soc]
+        index = self._ready_index(username)
+        if index is None:
+            return None
+        newest, generation, offset = -1, "", 0
+        fields = payload['since'].split(":")
+        if len(fields) == 3 and EMAIL_ID_PATTERN.fullmatch(fields[0]) \
+                and EMAIL_ID_PATTERN.fullmatch(fields[2]):
+            newest, generation, offset = int(fields[0]), fields[1], int(fields[2])
+        with self._storage_latency.time("sync"):
+            generation, offset, deleted = self._storage.deletions_since(
+                username, generation, offset)
+        reset = deleted is None
+        if reset:
+            newest, deleted = -1, []
+        added = []
+        for email_id in index.newer_than(newest):
+            email = index.get(email_id)
+            newest = max(newest, int(email_id))
+            added.append(gloutils.EmailSummary(
+                email_id=email_id,
+                sender=email.sender,
+                subject=email.subject,
+                date=email.date
+            ))
+        return create_packet(gloutils.Headers.OK, gloutils.SyncResultPayload(
+            cursor=f"{max(newest, 0)}:{generation}:{offset}",
+            added=added,
+            deleted=deleted,
+            reset=reset
+        ))
+
+    def _fetch_email(
+        self, client_soc: socket.socket, payload: gloutils.EmailIdPayload
+    ) -> gloutils.GloMessage:
+        """Récupère le contenu d'un courriel désigné par son identifiant."""
+        email_id = payload['email_id']
+        if EMAIL_ID_PATTERN.fullmatch(email_id) is None:
+            return create_error_packet("Courriel introuvable.")
+        return self._read_email(self._logged_users[client_soc], email_id)
+
+    def _read_email(self, username: str, email_id: str) -> gloutils.GloMessage:
+        """Lit un courriel complet, corps compris, depuis le stockage."""
+        try:
+            with self._storage_latency.time("read"):
+                content, _ = self._storage.read_email(
+                    self._storage.email_path(username, email_id))
+        except (OSError, ValueError, KeyError):
+            return create_error_packet("Courriel introuvable.")
+        return create_packet(gloutils.Headers.OK, content)
+
+    def _remove_email(self, username: str, email_id: str, path: str) -> None:
+        """
+        Supprime un courriel du disque et le retire des compteurs et de
+        l'index de l'utilisateur. Le corps partagé n'est supprimé que
+        lorsque plus aucune boîte ne le référence.
+        """
+        with self._storage_latency.time("delete"):
+            size = self._storage.remove_email(path)
+            self._storage.record_deletion(username, email_id)
+        if self._replicator is not None:
+            self._replicator.record(gloreplication.remove_op(username, email_id))
+        usage = self._usage.get(username)
+        if usage is not None:
+            usage[0] -= 1
+            usage[1] -= size
+        index = self._indexes.get(username)
+        if index is not None:
+            index.remove(email_id)
+
+    def _account_delivery(self, username: str, email_id: str,
+                          payload: gloutils.EmailContentPayload,
+                          size: int, mtime: float) -> None:
+        """
+        Tient les compteurs et l'index de l'utilisateur à jour après une
+        livraison et notifie ses sockets abonnés.
+        """
+        usage = self._usage.get(username)
+        if usage is not None:
+            usage[0] += 1
+            usage[1] += size
+        index = self._indexes.get(username)
+        if index is not None:
+            index.add(email_id, payload, mtime)
+        self._notify_new_mail(username, payload)
+
+    def _ready_index(self, username: str,
+                     bodies: bool = False) -> Optional[gloindex.MailboxIndex]:
+        """
+        Retourne l'index de l'utilisateur s'il est prêt, avec les termes
+        des corps si `bodies` est vrai. Sinon, lance sa construction et
+        retourne None: le gestionnaire retourne alors None à son tour et
+        la requête est reprise par la boucle une fois l'index prêt.
+
+        L'index est construit à partir des seules entrées de la boîte,
+        puis tenu à jour par `_send_email`; les corps ne sont lus que
+        pour une recherche par termes. Les deux passes s'exécutent par
+        étapes entre les tours de boucle (voir `_step_index_builds`).
+        Au-delà de `_index_cache_size` index, le moins récemment utilisé
+        est évincé et sera reconstruit au besoin.
+        """
+        index = self._indexes.get(username)
+        if index is None:
+            index = gloindex.MailboxIndex()
+            index.loaded = False
+            self._indexes[username] = index
+            self._index_builds[username] = self._load_index(username, index)
+            while len(self._indexes) > max(self._index_cache_size, 1):
+                evicted, _ = self._indexes.popitem(last=False)
+                self._index_builds.pop(evicted, None)
+            return None
+        self._indexes.move_to_end(username)
+        if not index.loaded:
+            return None
+        if bodies and not index.bodies_indexed:
+            if username not in self._index_builds:
+                self._index_builds[username] = self._index_bodies(username, index)
+            return None
+        return index
+
+    def _load_index(self, username: str,
+                    index: gloindex.MailboxIndex) -> Iterator[None]:
+        """Remplit l'index à partir des entrées de la boîte, une par étape."""
+        for email_id, path in self._storage.iter_emails(username):
+            # Un courriel livré pendant la construction y est déjà.
+            if index.get(email_id) is None:
+                try:
+                    payload, _ = self._storage.read_email(path, with_body=False)
+                    mtime = os.path.getmtime(path)
+                except (OSError, ValueError, KeyError):
+                    continue
+                index.add(email_id, payload, mtime)
+            yield
+        index.loaded = True
+
+    def _index_bodies(self, username: str,
+                      index: gloindex.MailboxIndex) -> Iterator[None]:
+        """Indexe les corps que la recherche par termes n'a pas encore lus."""
+        for email_id in index.unindexed_bodies():
+            try:
+                content, _ = self._storage.read_email(
+                    self._storage.email_path(username, email_id))
+            except (OSError, ValueError, KeyError):
+                content = {}
+            index.add_body(email_id, str(content.get("content", "")))
+            yield
+
+    def _step_index_builds(self) -> None:
+        """
+        Avance les constructions d'index pendant au plus
+        `gloutils.INDEX_BUILD_BUDGET` secondes, puis reprend les requêtes
+        qui les attendaient.
+        """
+        deadline = time.monotonic() + gloutils.INDEX_BUILD_BUDGET
+        with self._storage_latency.time("index_build"):
+            for username, build in list(self._index_builds.items()):
+                try:
+                    while time.monotonic() < deadline:
+                        next(build)
+                except StopIteration:
+                    del self._index_builds[username]
+                if time.monotonic() >= deadline:
+                    break
+        for client_soc, (route, payload) in list(self._parked.items()):
+            with self._request_latency.time(route.name):
+                response = route.handler(client_soc, payload)
+            if response is not None:
+                del self._parked[client_soc]
+                self._queue_packet(client_soc, response)
+
+    def _search_emails(
+        self, client_soc: socket.socket, payload: gloutils.SearchPayload
+    ) -> gloutils.GloMessage:
+        """
+        Recherche dans la boîte de l'utilisateur les courriels satisfaisant
+        tous les critères fournis et retourne la page demandée.
 
-        _, chosen_payload, _ = email_files[choice-1]
-        return create_packet(gloutils.Headers.OK, gloutils.EmailContentPayload(
-            sender=chosen_payload.get('sender'),
-            destination=chosen_payload.get('destination'),
-            subject=chosen_payload.get('subject'),
-            date=chosen_payload.get('date'),
-            content=chosen_payload.get('content')
+        Les résultats suivent le gabarit SUBJECT_DISPLAY; leur numéro est
+        celui du courriel dans la boîte, utilisable avec INBOX_READING_CHOICE.
+        """
+        page = payload.get('page')
+        if page is None:
+            page = 1
+        try:
+            date_from = payload.get('date_from')
+            date_to = payload.get('date_to')
+            date_from = gloindex.parse_search_day(date_from) if date_from else None
+            date_to = gloindex.parse_search_day(date_to, end_of_day=True) if date_to else None
+        except ValueError:
+            return create_error_packet("Date invalide, utilisez le format AAAA-MM-JJ.")
+        if not isinstance(page, int) or isinstance(page, bool) or page < 1:
+            return create_error_packet("Page invalide.")
+
+        index = self._ready_index(self._logged_users[client_soc],
+                                  bodies=bool(payload.get('terms')))
+        if index is None:
+            return None
+        with self._storage_latency.time("search"):
+            matches = index.search(
+                sender=payload.get('sender') or "",
+                subject=payload.get('subject') or "",
+                terms=payload.get('terms') or "",
+                date_from=date_from,
+                date_to=date_to
+            )
+            results = index.page(matches, page, gloutils.SEARCH_PAGE_SIZE)
+        email_list = [gloutils.SUBJECT_DISPLAY.format(
+            number=index.rank(email),
+            sender=email.sender,
+            subject=email.subject,
+            date=email.date
+        ) for email in results]
+        page_count = -(-len(matches) // gloutils.SEARCH_PAGE_SIZE)
+        return create_packet(gloutils.Headers.OK, gloutils.SearchResultPayload(
+            email_list=email_list,
+            page=page,
+            page_count=page_count
         ))
 
     def _get_stats(self, client_soc: socket.socket) -> gloutils.GloMessage:
@@ -290,24 +1223,42 @@ class Server:
         Récupère le nombre de courriels et la taille du dossier et des fichiers
         de l'utilisateur associé au socket.
         """
-        username = self._logged_users[client_soc]
-        user_dir = f"./{gloutils.SERVER_DATA_DIR}/{username}"
-        if not os.path.isdir(user_dir):
-            return create_packet(gloutils.Headers.OK, gloutils.StatsPayload(count=0, size=0))
-
-        files = [f for f in os.listdir(user_dir) if f != f"{gloutils.PASSWORD_FILENAME}.txt"]
-        count = 0
-        size = 0
-        for f in files:
-            full = os.path.join(user_dir, f)
-            if os.path.isfile(full):
-                count += 1
-                size += os.path.getsize(full)
-
+        count, size = self._get_usage(self._logged_users[client_soc])
         return create_packet(gloutils.Headers.OK, gloutils.StatsPayload(count=count, size=size))
 
+    def _get_usage(self, username: str) -> list[int]:
+        """
+        Retourne les compteurs `[nombre, taille]` de la boîte de l'utilisateur.
+        Ils sont calculés par un parcours du dossier au premier usage, puis
+        tenus à jour à chaque livraison. La taille est la taille logique
+        des courriels, indépendante du partage des corps sur le disque.
+        Comme dans la liste de la boîte, une entrée illisible est ignorée.
+        """
+        usage = self._usage.get(username)
+        if usage is not None:
+            self._usage.move_to_end(username)
+            return usage
+        usage = [0, 0]
+        with self._storage_latency.time("stats"):
+            for _, full in self._storage.iter_emails(username):
+                try:
+                    size = self._storage.read_email(full, with_body=False)[1]
+                except (OSError, ValueError, KeyError):
+                    continue
+                usage[0] += 1
+                usage[1] += size
+        self._cache_usage(username, usage)
+        return usage
+
+    def _cache_usage(self, username: str, usage: list[int]) -> None:
+        """Conserve les compteurs, en évinçant les moins récemment utilisés."""
+        self._usage[username] = usage
+        self._usage.move_to_end(username)
+        while len(self._usage) > max(self._usage_cache_size, 1):
+            self._usage.popitem(last=False)
+
     def _send_email(self, payload: gloutils.EmailContentPayload) -> gloutils.GloMessage:
-        print(payload)
+        self._logger.debug("sending email to %s", payload.get('destination'))
         destination = payload.get('destination')
         if not destination or '@' not in destination:
             return create_error_packet("Adresse destinataire invalide.")
@@ -317,25 +1268,46 @@ class Server:
             return create_error_packet("Destinataire externe non supporté.")
         
         username = username.lower()
+        data = json.dumps(payload).encode('utf-8')
+        if self._max_message and len(data) > self._max_message:
+            self._rejected.inc(label_value="message_size")
+            return create_error_packet("Courriel trop volumineux.")
 
         if self._has_user_dir(username):
-            folder = f"./{gloutils.SERVER_DATA_DIR}/{username}"
-            filename = f"{int(time.time()*1000)}.json"
-            full = os.path.join(folder, filename)
+            usage = self._get_usage(username)
+            if self._quota and usage[1] + len(data) > self._quota:
+                self._rejected.inc(label_value="quota")
+                return create_error_packet("La boîte du destinataire est pleine.")
+            email_id = self._storage.new_email_id()
+            full = self._storage.email_path(username, email_id)
             try:
-                with open(full, 'w', encoding='utf-8') as fh:
-                    json.dump(payload, fh)
-            except (OSError, TypeError):
+                with self._storage_latency.time("deliver"):
+                    written = self._storage.write_email(full, payload, len(data))
+            except OSError:
                 return create_error_packet("Impossible d'écrire le message dans le dossier du destinataire.")
+            mtime = os.path.getmtime(full)
+            if self._replicator is not None:
+                # Un corps déjà stocké l'est aussi sur les relèves.
+                self._replicator.record(gloreplication.deliver_op(
+                    username, email_id, payload, len(data), mtime,
+                    shared=not written))
+            self._account_delivery(username, email_id, payload, len(data), mtime)
             return create_ok_packet()
         else:
-            filename = f"{int(time.time()*1000)}.json"
-            full = os.path.join(f"./{gloutils.SERVER_DATA_DIR}/{gloutils.SERVER_LOST_DIR}", filename)
+            if self._lost_usage is None:
+                with self._storage_latency.time("stats"):
+                    self._lost_usage = self._storage.lost_size()
+            if self._lost_quota and self._lost_usage + len(data) > self._lost_quota:
+                self._rejected.inc(label_value="lost_quota")
+                return create_error_packet("Destinataire introuvable.")
+            full = self._storage.lost_path(self._storage.new_email_id())
             try:
-                with open(full, 'w', encoding='utf-8') as fh:
-                    json.dump(payload, fh)
-            except (OSError, TypeError):
+                with self._storage_latency.time("deliver_lost"):
+                    self._storage.write(full, data)
+            except OSError:
+                self._logger.warning("cannot write lost email %s", full)
                 return create_error_packet("Impossible d'enregistrer le message perdu.")
+            self._lost_usage += len(data)
             return create_error_packet("Destinataire introuvable. Courriel placé dans le dossier LOST.")
 
         
@@ -351,77 +1323,300 @@ class Server:
         Retourne un messange indiquant le succès ou l'échec de l'opération.
         """
 
-    
-    def _queue_packet(self, client: socket.socket, message: gloutils.GloMessage):
-        glosocket.send_mesg(client, json.dumps(message))
+    def _read_only(self, client_soc: socket.socket, payload) -> gloutils.GloMessage:
+        return create_error_packet("Serveur de relève: requête en lecture seule uniquement.")
 
-    def _handle_packet(self, client: socket.socket, packet: str) -> None:
-        authenticated_handlers = {
-            gloutils.Headers.INBOX_READING_REQUEST: lambda client, _ : self._get_email_list(client),
-            gloutils.Headers.INBOX_READING_CHOICE:  lambda client, packet : self._get_email(client, gloutils.EmailChoicePayload(packet.get("payload"))),
-            gloutils.Headers.EMAIL_SENDING:          lambda client, packet : self._send_email(gloutils.EmailContentPayload(packet.get("payload"))),
-            gloutils.Headers.STATS_REQUEST:         lambda client, _ : self._get_stats(client),
-            gloutils.Headers.AUTH_LOGOUT:           lambda client, _ : self._logout(client),
-        }
+    def _replication_hello(
+        self, client_soc: socket.socket,
+        payload: gloutils.ReplicationHelloPayload
+    ) -> gloutils.GloMessage:
+        """
+        Identifie la connexion comme le flux de réplication du primaire,
+        si elle présente le secret partagé, et retourne la position de la
+        relève. Seuls les lots reçus sur une telle connexion sont appliqués.
+        """
+        if self._role != STANDBY:
+            return create_error_packet("Ce serveur n'est pas une relève.")
+        if not self._replication_secret or not hmac.compare_digest(
+                payload['secret'].encode('utf-8'),
+                self._replication_secret.encode('utf-8')):
+            self._rejected.inc(label_value="replication_auth")
+            self._logger.warning("replication stream refused: bad secret")
+            return create_error_packet("Flux de réplication refusé.")
+        self._replication_sources.add(client_soc)
+        self._logger.info("primary connected, epoch %s", payload['epoch'])
+        epoch, seq = self._replication_position
+        return create_packet(gloutils.Headers.OK, gloutils.ReplicationPositionPayload(
+            epoch=epoch,
+            seq=seq
+        ))
 
-        anonymous_handlers = {
-            gloutils.Headers.AUTH_REGISTER:         lambda client, packet : self._create_account(client, gloutils.AuthPayload(packet.get("payload"))),
-            gloutils.Headers.AUTH_LOGIN:            lambda client, packet : self._login(client, gloutils.AuthPayload(packet.get("payload")))
-        }
+    def _replication_batch(
+        self, client_soc: socket.socket,
+        payload: gloutils.ReplicationBatchPayload
+    ) -> gloutils.GloMessage:
+        """
+        Applique un lot de mutations du primaire, enregistre la position
+        atteinte et la retourne en guise d'accusé de réception. Une
+        opération invalide est journalisée puis ignorée.
+
+        Si un corps référencé manque, la relève oublie sa position et
+        refuse le lot: le primaire coupe le flux et lui enverra un
+        instantané à la reconnexion.
+        """
+        if client_soc not in self._replication_sources:
+            return create_error_packet("Flux de réplication non identifié.")
+        for op in payload['ops']:
+            try:
+                self._replication_ops[op['op']](op)
+            except gloreplication.MissingBody as ex:
+                self._logger.error("missing replicated body %s, resynchronizing", ex)
+                # Les lots déjà en route ne doivent pas avancer la position.
+                self._replication_sources.discard(client_soc)
+                self._replication_position = gloreplication.NO_POSITION
+                gloreplication.save_position(self._storage.replication_path,
+                                             *self._replication_position)
+                return create_error_packet("Corps répliqué introuvable.")
+            except (OSError, KeyError, TypeError, ValueError) as ex:
+                self._logger.error("cannot apply replicated operation: %r", ex)
+        self._replication_applied.inc(len(payload['ops']))
+        if payload['seq'] >= 0:
+            self._replication_position = (payload['epoch'], payload['seq'])
+            gloreplication.save_position(self._storage.replication_path,
+                                         *self._replication_position)
+        return create_packet(gloutils.Headers.OK, gloutils.ReplicationPositionPayload(
+            epoch=payload['epoch'],
+            seq=payload['seq']
+        ))
 
+    def _replicated_path(self, op: dict) -> str:
+        """Valide l'utilisateur et le courriel visés par une opération répliquée."""
+        if not self._validate_username(op['username']) \
+                or EMAIL_ID_PATTERN.fullmatch(op['email_id']) is None:
+            raise ValueError(op['op'])
+        return self._storage.email_path(op['username'], op['email_id'])
+
+    def _apply_create_user(self, op: dict) -> None:
+        username = op['username']
+        if not self._validate_username(username):
+            raise ValueError(op['op'])
+        if not self._storage.has_user(username):
+            self._create_user_dir(username)
+            self._cache_usage(username, [0, 0])
+        self._save_password_hash(username, op['password'])
+
+    def _apply_deliver(self, op: dict) -> None:
+        path = self._replicated_path(op)
+        username = op['username']
+        if os.path.exists(path) or not self._storage.has_user(username):
+            return
+        payload = op['payload']
+        if 'digest' in op:
+            if DIGEST_PATTERN.fullmatch(op['digest']) is None:
+                raise ValueError(op['op'])
+            content = self._storage.read_body(op['digest'])
+            if content is None:
+                raise gloreplication.MissingBody(op['digest'])
+            payload = dict(payload, content=content)
+        with self._storage_latency.time("deliver"):
+            self._storage.write_email(path, payload, op['size'])
+            os.utime(path, (op['mtime'], op['mtime']))
+        self._account_delivery(username, op['email_id'], payload,
+                               op['size'], op['mtime'])
+
+    def _apply_remove(self, op: dict) -> None:
+        path = self._replicated_path(op)
+        if os.path.exists(path):
+            self._remove_email(op['username'], op['email_id'], path)
+
+    def _apply_mailbox(self, op: dict) -> None:
+        username = op['username']
+        if not self._validate_username(username):
+            raise ValueError(op['op'])
+        kept = set(op['email_ids'])
+        for email_id, path in list(self._storage.iter_emails(username)):
+            if email_id not in kept:
+                self._remove_email(username, email_id, path)
+
+    def _queue_packet(self, client: socket.socket, message: gloutils.GloMessage):
+        """
+        Ajoute le message à la file d'envoi du client et en transmet ce
+        que le socket accepte sans bloquer. Le reste part lorsque select
+        signale le socket disponible en écriture (voir `_flush_outbox`).
+        """
+        data = glosocket.encode_mesg(json.dumps(message))
+        self._bytes_out.inc(len(data))
+        self._outboxes.setdefault(client, bytearray()).extend(data)
+        self._flush_outbox(client)
+
+    def _flush_outbox(self, client: socket.socket) -> None:
+        """Transmet sans bloquer la file d'envoi du client."""
+        outbox = self._outboxes[client]
+        try:
+            sent = glosocket.send_available(client, outbox)
+        except glosocket.GLOSocketError:
+            self._remove_client(client)
+            return
+        del outbox[:sent]
+        if not outbox:
+            del self._outboxes[client]
+
+    def _handle_packet(self, client: socket.socket, packet: str) -> None:
         try:
             parsed_packet = parse_packet(packet)
+            if not isinstance(parsed_packet, dict):
+                raise BadPacket("Le paquet n'est pas un objet.")
             header = parsed_packet.get("header")
 
             if header == gloutils.Headers.BYE:
                 self._remove_client(client)
                 return
 
-            if client in self._logged_users:
-                if header in authenticated_handlers:
-                    self._queue_packet(client, authenticated_handlers[header](client, parsed_packet))
-                elif header in anonymous_handlers:
-                    self._queue_packet(client, create_error_packet("Utilisateur déjà authentifié"))
-                else:
-                    self._queue_packet(client, create_error_packet("Requête inconnue."))
-            else:
-                if header in anonymous_handlers:
-                    self._queue_packet(client, anonymous_handlers[header](client, parsed_packet))
-                elif header in authenticated_handlers:
-                    self._queue_packet(client, create_error_packet("Utilisateur non authentifié."))
-                else:
-                    self._queue_packet(client, create_error_packet("Requête inconnue."))
+            now = time.monotonic()
+            # Le flux de réplication du primaire n'est pas limité.
+            replication = client in self._replication_sources
+            if not replication and not self._connection_limiter.allow(client, now):
+                self._rejected.inc(label_value="connection_rate")
+                self._queue_packet(client, create_error_packet(
+                    "Trop de requêtes, réessayez plus tard."))
+                return
+            username = self._logged_users.get(client)
+            if username is not None and not self._user_limiter.allow(username, now):
+                self._rejected.inc(label_value="user_rate")
+                self._queue_packet(client, create_error_packet(
+                    "Trop de requêtes, réessayez plus tard."))
+                return
+
+            route = self._routes.get(header) if isinstance(header, int) else None
+            if route is None:
+                self._queue_packet(client, create_error_packet("Requête inconnue."))
+                return
+            if route.requires_auth != (client in self._logged_users):
+                self._queue_packet(client, create_error_packet(
+                    "Utilisateur non authentifié." if route.requires_auth
+                    else "Utilisateur déjà authentifié"))
+                return
+
+            payload = parsed_packet.get("payload")
+            if route.schema is not None and not validate_payload(payload, route.schema):
+                raise BadPacket("Payload invalide.")
+            with self._request_latency.time(route.name):
+                response = route.handler(client, payload)
+            if response is None:
+                # L'index se construit: la requête attend, et les suivantes
+                # du client avec elle.
+                self._parked[client] = (route, payload)
+                return
+            self._queue_packet(client, response)
         except (BadPacket, ValueError):
             self._queue_packet(client, create_error_packet("Packet invalide."))
 
     def run(self):
         """Point d'entrée du serveur."""
-
-        authenticated_methods_handlers = {
-            gloutils.Headers.INBOX_READING_REQUEST: self._get_email_list,
-            gloutils.Headers.INBOX_READING_CHOICE: self._get_email,
-            gloutils.Headers.AUTH_LOGOUT: self._logout,
-            gloutils.Headers.STATS_REQUEST: self._get_stats
-        }
-
-        waiters: list[socket.socket] = []
         while True:
-            result = select.select(self._client_socs + [self._server_socket], [], [])
-            waiters.extend(result[0])
-            for waiter in waiters:
-                waiters.pop(0)
+            listeners = [self._server_socket, self._wakeup_r]
+            if self._metrics_socket is not None:
+                listeners.append(self._metrics_socket)
+            timeout = self._sweeper.idle_timeout()
+            if self._index_builds:
+                timeout = 0
+            log_delay = glometrics.logging_delay(self._logger)
+            if log_delay is not None:
+                timeout = min(timeout, log_delay)
+            replica_socs = []
+            if self._replicator is not None:
+                replica_socs = self._replicator.sockets()
+                listeners.extend(self._replicator.readers())
+                replication_timeout = self._replicator.idle_timeout(time.monotonic())
+                if replication_timeout is not None:
+                    timeout = min(timeout, replication_timeout)
+            clients = self._client_socs
+            if self._parked:
+                clients = [client_soc for client_soc in clients
+                           if client_soc not in self._parked]
+            writers: list[socket.socket] = []
+            if self._outboxes:
+                # Un client dont la file d'envoi est pleine n'est plus lu
+                # tant qu'il n'a pas consommé ses réponses.
+                clients = [client_soc for client_soc in clients
+                           if len(self._outboxes.get(client_soc, b""))
+                           < gloutils.OUTBOX_MAX_BYTES]
+                writers.extend(self._outboxes)
+            if self._replicator is not None:
+                writers.extend(self._replicator.writers())
+            readers = clients + listeners
+            if self._handshakes:
+                for tls_soc, (deadline, wants_write) in self._handshakes.items():
+                    (writers if wants_write else readers).append(tls_soc)
+                    timeout = min(timeout, max(0.0, deadline - time.monotonic()))
+            for metrics_soc, connection in self._metrics_clients.items():
+                (writers if connection.wants_write else readers).append(metrics_soc)
+                timeout = min(timeout, max(0.0, connection.deadline - time.monotonic()))
+            readable, writable, _ = select.select(readers, writers, [], timeout)
+            idle = not (readable or writable)
+            self._sweeper.maybe_step(idle=idle)
+            if idle or glometrics.logging_delay(self._logger) == 0.0:
+                # Le serveur est au repos, ou des entrées attendent depuis
+                # trop longtemps: le journal ne doit pas rester en mémoire.
+                glometrics.flush_logging(self._logger)
+            flushed = set(writable) & self._outboxes.keys()
+            for client_soc in flushed:
+                self._flush_outbox(client_soc)
+            writable = set(writable) - flushed
+            waiters: list[socket.socket] = list(readable) + list(writable)
+            while waiters:
+                waiter = waiters.pop(0)
+                self._pending_requests.set(len(waiters))
                 if waiter is self._server_socket:
                     self._accept_client()
 
+                elif waiter is self._metrics_socket:
+                    self._serve_metrics()
+
+                elif waiter is self._wakeup_r:
+                    self._wakeup_r.recv(4096)
+
+                elif waiter in self._handshakes:
+                    self._continue_handshake(waiter)
+
+                elif waiter in self._metrics_clients:
+                    self._continue_metrics(waiter, waiter in writable)
+
+                elif waiter in replica_socs:
+                    self._replicator.handle_ready(waiter)
+
                 else:
                     try:
-                        data = glosocket.recv_mesg(waiter)
+                        data, size = glosocket.recv_mesg_sized(waiter)
                     except glosocket.GLOSocketError:
                         self._remove_client(waiter)
                         continue
+                    except UnicodeDecodeError:
+                        # La trame a été lue en entier: le flux reste aligné.
+                        self._queue_packet(waiter, create_error_packet("Packet invalide."))
+                        continue
+                    self._bytes_in.inc(size)
 
                     self._handle_packet(waiter, data)
-                    pass
+
+                # Des messages déjà déchiffrés restent invisibles à select.
+                if isinstance(waiter, ssl.SSLSocket) and waiter.pending():
+                    waiters.append(waiter)
+
+            if self._index_builds:
+                self._step_index_builds()
+
+            if self._handshakes:
+                self._expire_handshakes(time.monotonic())
+
+            if self._metrics_clients:
+                self._expire_metrics(time.monotonic())
+
+            if self._replicator is not None:
+                self._replicator.flush(time.monotonic())
+
+            if self._reload_requested and self._handoff():
+                return
 
 
 # NE PAS ÉDITER PASSÉ CE POINT
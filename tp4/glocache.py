@@ -0,0 +1,108 @@
+"""\
+Module fournissant le cache local des courriels du client.
+
+Disposition:
+    <racine>/<serveur>_<port>/<utilisateur>/index.json
+    <racine>/<serveur>_<port>/<utilisateur>/<id>.json
+
+Deux serveurs sur une même machine ont ainsi des caches distincts.
+
+`index.json` conserve le curseur de synchronisation, l'ordre de la
+boîte et les entêtes; chaque courriel déjà lu est conservé en entier.
+"""
+import json
+import os
+from typing import Optional
+
+import gloutils
+
+INDEX_FILENAME = "index.json"
+
+
+class MailCache:
+    """Cache sur disque de la boîte d'un utilisateur."""
+
+    def __init__(self, server: str, port: int, username: str,
+                 root: str = gloutils.CLIENT_CACHE_DIR) -> None:
+        self._directory = os.path.join(root, f"{server}_{port}",
+                                       username.lower())
+        self.cursor = ""
+        self.email_ids: list[str] = []
+        self._summaries: dict[str, gloutils.EmailSummary] = {}
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._directory, name)
+
+    def _load(self) -> None:
+        try:
+            with open(self._path(INDEX_FILENAME), "r", encoding="utf-8") as file:
+                state = json.load(file)
+            self.cursor = state["cursor"]
+            self.email_ids = state["email_ids"]
+            self._summaries = state["summaries"]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.cursor, self.email_ids, self._summaries = "", [], {}
+
+    def _save(self) -> None:
+        os.makedirs(self._directory, exist_ok=True)
+        temporary = self._path(INDEX_FILENAME + ".tmp")
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({"cursor": self.cursor, "email_ids": self.email_ids,
+                       "summaries": self._summaries}, file)
+        os.replace(temporary, self._path(INDEX_FILENAME))
+
+    def apply_sync(self, result: gloutils.SyncResultPayload) -> None:
+        """
+        Intègre le résultat d'une synchronisation: ajoute les nouveaux
+        entêtes en tête de boîte et oublie les courriels supprimés du
+        serveur. Une resynchronisation complète remplace tout le cache.
+        """
+        if result["reset"]:
+            present = {summary["email_id"] for summary in result["added"]}
+            for email_id in [email_id for email_id in self._summaries
+                             if email_id not in present]:
+                self._forget(email_id)
+            self.email_ids = []
+        deleted = set(result["deleted"])
+        for email_id in deleted:
+            self._forget(email_id)
+        if deleted:
+            self.email_ids = [email_id for email_id in self.email_ids
+                              if email_id not in deleted]
+        for summary in result["added"]:
+            self._summaries[summary["email_id"]] = summary
+        self.email_ids[:0] = [summary["email_id"] for summary in result["added"]]
+        self.cursor = result["cursor"]
+        self._save()
+
+    def summary(self, email_id: str) -> gloutils.EmailSummary:
+        return self._summaries[email_id]
+
+    def get_email(self, email_id: str) -> Optional[gloutils.EmailContentPayload]:
+        """Retourne le courriel s'il a déjà été lu, None sinon."""
+        try:
+            with open(self._path(f"{email_id}.json"), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def put_email(self, email_id: str,
+                  email: gloutils.EmailContentPayload) -> None:
+        os.makedirs(self._directory, exist_ok=True)
+        with open(self._path(f"{email_id}.json"), "w", encoding="utf-8") as file:
+            json.dump(email, file)
+
+    def remove(self, email_id: str) -> None:
+        """Retire un courriel supprimé par l'utilisateur."""
+        if email_id in self.email_ids:
+            self.email_ids.remove(email_id)
+        self._forget(email_id)
+        self._save()
+
+    def _forget(self, email_id: str) -> None:
+        self._summaries.pop(email_id, None)
+        try:
+            os.remove(self._path(f"{email_id}.json"))
+        except OSError:
+            pass
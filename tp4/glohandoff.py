@@ -0,0 +1,160 @@
+"""\
+Module fournissant le redémarrage sans interruption du serveur:
+le processus courant lance son remplaçant en lui transmettant ses
+sockets (écoute et clients) et l'état des sessions, puis se retire
+dès que le remplaçant est prêt.
+
+Une connexion qui ne peut être transmise telle quelle (TLS, envoi
+entamé) est relayée: le remplaçant en reçoit une paire de sockets
+locale, et le processus précédent ne fait plus que recopier les
+octets entre le client et cette paire jusqu'à la fermeture (`Relay`).
+"""
+import json
+import os
+import select
+import socket
+import ssl
+import subprocess  # nosec:B404
+import sys
+from typing import Optional
+
+import glosocket
+import gloutils
+
+STATE_VARIABLE = "GLO_HANDOFF_STATE"
+READY_VARIABLE = "GLO_HANDOFF_READY"
+
+
+def read_state() -> Optional[dict]:
+    """
+    Retourne l'état transmis par le processus précédent, ou None pour
+    un démarrage à froid. Les variables sont retirées de l'environnement
+    pour ne pas être héritées par un prochain remplaçant.
+    """
+    state = os.environ.pop(STATE_VARIABLE, None)
+    if state is None:
+        return None
+    state = json.loads(state)
+    state["ready_fd"] = int(os.environ.pop(READY_VARIABLE))
+    return state
+
+
+def signal_ready(state: dict) -> None:
+    """Prévient le processus précédent que le remplaçant sert les requêtes."""
+    try:
+        os.write(state["ready_fd"], b"1")
+    finally:
+        os.close(state["ready_fd"])
+
+
+def spawn_successor(state: dict, fds: list[int],
+                    timeout: float) -> Optional[subprocess.Popen]:
+    """
+    Lance un nouveau processus serveur avec la même commande en lui
+    transmettant `fds` et `state`. Retourne le processus une fois
+    qu'il s'est déclaré prêt, ou None s'il a échoué dans le délai.
+    """
+    ready_r, ready_w = os.pipe()
+    env = dict(os.environ)
+    env[STATE_VARIABLE] = json.dumps(state)
+    env[READY_VARIABLE] = str(ready_w)
+    try:
+        successor = subprocess.Popen(  # nosec:B603
+            [sys.executable] + sys.argv, env=env, pass_fds=fds + [ready_w])
+    except OSError:
+        os.close(ready_r)
+        os.close(ready_w)
+        return None
+    os.close(ready_w)
+    try:
+        readable, _, _ = select.select([ready_r], [], [], timeout)
+        if readable and os.read(ready_r, 1) == b"1":
+            return successor
+    finally:
+        os.close(ready_r)
+    successor.kill()
+    successor.wait()
+    return None
+
+
+class Relay:
+    """
+    Relaie sans les interpréter les octets entre `client`, resté dans le
+    processus précédent, et `local`, dont la paire est servie par le
+    remplaçant. `to_client` et `to_local` sont les octets déjà en
+    attente dans chaque sens; avec `handshake_deadline`, la poignée de
+    main TLS du client est d'abord menée à terme.
+    """
+
+    def __init__(self, client: socket.socket, local: socket.socket,
+                 to_client: bytes = b"", to_local: bytes = b"",
+                 handshake_deadline: Optional[float] = None) -> None:
+        client.setblocking(False)
+        local.setblocking(False)
+        self.client = client
+        self.local = local
+        self.handshake_deadline = handshake_deadline
+        self._wants_write = False
+        self._peers = {client: local, local: client}
+        # Octets en attente d'écriture vers chaque socket.
+        self._pending = {client: bytearray(to_client), local: bytearray(to_local)}
+
+    def readers(self) -> list[socket.socket]:
+        if self.handshake_deadline is not None:
+            return [] if self._wants_write else [self.client]
+        return [source for source, dest in self._peers.items()
+                if len(self._pending[dest]) < gloutils.OUTBOX_MAX_BYTES]
+
+    def writers(self) -> list[socket.socket]:
+        if self.handshake_deadline is not None:
+            return [self.client] if self._wants_write else []
+        return [dest for dest, pending in self._pending.items() if pending]
+
+    def pump(self) -> bool:
+        """
+        Recopie dans les deux sens ce qui peut l'être sans bloquer.
+        Retourne False une fois la connexion terminée d'un côté ou de
+        l'autre; ce qui restait à transmettre l'est au mieux.
+        """
+        if self.handshake_deadline is not None:
+            try:
+                self.client.do_handshake()
+            except ssl.SSLWantReadError:
+                self._wants_write = False
+                return True
+            except ssl.SSLWantWriteError:
+                self._wants_write = True
+                return True
+            except (ssl.SSLError, OSError):
+                return False
+            self.handshake_deadline = None
+        try:
+            for source, dest in self._peers.items():
+                pending = self._pending[dest]
+                closed = self._receive(source, pending)
+                if pending:
+                    del pending[:glosocket.send_available(dest, pending)]
+                if closed:
+                    return False
+        except glosocket.GLOSocketError:
+            return False
+        return True
+
+    @staticmethod
+    def _receive(source: socket.socket, pending: bytearray) -> bool:
+        """Lit ce qui est disponible; retourne True si `source` est fermé."""
+        while len(pending) < gloutils.OUTBOX_MAX_BYTES:
+            try:
+                chunk = source.recv(65536)
+            except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                return False
+            except OSError:
+                return True
+            if not chunk:
+                return True
+            pending += chunk
+        return False
+
+    def close(self) -> None:
+        self.client.close()
+        self.local.close()
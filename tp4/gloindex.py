@@ -0,0 +1,221 @@
+"""\
+Module fournissant l'index inversé des boîtes de réception,
+utilisé par le serveur pour la recherche de courriels.
+"""
+import bisect
+import datetime
+import heapq
+import re
+from typing import Iterator, NamedTuple, Optional
+
+DATE_FORMAT = "%a, %d %b %Y %H:%M:%S %z"
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> set[str]:
+    """Découpe un texte en termes normalisés."""
+    return set(_TOKEN_PATTERN.findall(text.lower()))
+
+
+def parse_email_date(date: str) -> Optional[float]:
+    """Convertit la date d'un courriel en horodatage, None si invalide."""
+    try:
+        return datetime.datetime.strptime(date, DATE_FORMAT).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_search_day(day: str, end_of_day: bool = False) -> float:
+    """
+    Convertit une date AAAA-MM-JJ (UTC) en horodatage. Lève ValueError
+    si le format est invalide.
+    """
+    moment = datetime.datetime.strptime(day, "%Y-%m-%d").replace(
+        tzinfo=datetime.timezone.utc)
+    if end_of_day:
+        moment += datetime.timedelta(days=1, microseconds=-1)
+    return moment.timestamp()
+
+
+class IndexedEmail(NamedTuple):
+    """Métadonnées d'un courriel conservées par l'index."""
+    email_id: str
+    mtime: float
+    sender: str
+    subject: str
+    date: str
+
+
+class MailboxIndex:
+    """
+    Index inversé d'une boîte de réception.
+
+    Les courriels sont identifiés par `email_id` et ordonnés par date
+    de réception (`mtime`), comme dans la liste de la boîte. L'index
+    est maintenu au fil des livraisons plutôt que reconstruit.
+
+    Les entêtes suffisent à la synchronisation et aux recherches par
+    expéditeur, sujet ou date: un courriel ajouté sans `content` n'est
+    indexé par ses termes qu'une fois son corps fourni à `add_body`.
+
+    `loaded` est faux tant que le serveur construit l'index par étapes:
+    il ne contient alors qu'une partie de la boîte.
+    """
+
+    def __init__(self) -> None:
+        self.loaded = True
+        self._emails: dict[str, IndexedEmail] = {}
+        self._order: list[tuple[float, str]] = []
+        self._ids: list[tuple[int, str]] = []
+        self._dates: list[tuple[float, str]] = []
+        self._senders: dict[str, set[str]] = {}
+        self._subject_terms: dict[str, set[str]] = {}
+        self._body_terms: dict[str, set[str]] = {}
+        self._unindexed_bodies: set[str] = set()
+        self._stale = 0
+
+    def __len__(self) -> int:
+        return len(self._emails)
+
+    def add(self, email_id: str, payload: dict, mtime: float) -> None:
+        """Ajoute un courriel à l'index."""
+        if email_id in self._emails:
+            self.remove(email_id)
+        sender = str(payload.get("sender", ""))
+        subject = str(payload.get("subject", ""))
+        date = str(payload.get("date", ""))
+        self._emails[email_id] = IndexedEmail(email_id, mtime, sender,
+                                              subject, date)
+        bisect.insort(self._order, (mtime, email_id))
+        bisect.insort(self._ids, (int(email_id), email_id))
+        timestamp = parse_email_date(date)
+        if timestamp is not None:
+            bisect.insort(self._dates, (timestamp, email_id))
+        for key in self._sender_keys(sender):
+            self._senders.setdefault(key, set()).add(email_id)
+        for term in tokenize(subject):
+            self._subject_terms.setdefault(term, set()).add(email_id)
+        if "content" in payload:
+            self.add_body(email_id, str(payload["content"]))
+        else:
+            self._unindexed_bodies.add(email_id)
+
+    def add_body(self, email_id: str, content: str) -> None:
+        """Indexe les termes du corps d'un courriel déjà ajouté."""
+        if email_id not in self._emails:
+            return
+        self._unindexed_bodies.discard(email_id)
+        for term in tokenize(content):
+            self._body_terms.setdefault(term, set()).add(email_id)
+
+    def unindexed_bodies(self) -> list[str]:
+        """Identifiants des courriels dont le corps reste à indexer."""
+        return list(self._unindexed_bodies)
+
+    @property
+    def bodies_indexed(self) -> bool:
+        """Indique si les termes de tous les corps sont indexés."""
+        return not self._unindexed_bodies
+
+    def remove(self, email_id: str) -> None:
+        """
+        Retire un courriel de l'index, s'il y est. Les listes de termes
+        ne sont pas parcourues: les identifiants retirés y restent jusqu'au
+        compactage et sont filtrés à la recherche.
+        """
+        email = self._emails.pop(email_id, None)
+        if email is None:
+            return
+        self._unindexed_bodies.discard(email_id)
+        self._stale += 1
+        position = bisect.bisect_left(self._order, (email.mtime, email_id))
+        del self._order[position]
+        del self._ids[bisect.bisect_left(self._ids, (int(email_id), email_id))]
+        timestamp = parse_email_date(email.date)
+        if timestamp is not None:
+            position = bisect.bisect_left(self._dates, (timestamp, email_id))
+            del self._dates[position]
+
+    @property
+    def stale(self) -> int:
+        """Nombre de courriels retirés encore présents dans les listes de termes."""
+        return self._stale
+
+    def compact(self) -> Iterator[None]:
+        """
+        Purge les listes de termes des courriels retirés, par étapes:
+        chaque itération traite une liste de termes.
+        """
+        self._stale = 0
+        for postings in (self._senders, self._subject_terms, self._body_terms):
+            for term in list(postings):
+                ids = postings.get(term)
+                if ids is not None:
+                    ids.intersection_update(self._emails.keys())
+                    if not ids:
+                        del postings[term]
+                yield
+
+    @staticmethod
+    def _sender_keys(sender: str) -> set[str]:
+        address = sender.lower()
+        return {address, address.split("@", 1)[0]}
+
+    def get(self, email_id: str) -> Optional[IndexedEmail]:
+        return self._emails.get(email_id)
+
+    def newest_first(self) -> list[str]:
+        """Identifiants des courriels, dans l'ordre de la boîte."""
+        return [email_id for _, email_id in reversed(self._order)]
+
+    def newer_than(self, email_id: int) -> list[str]:
+        """
+        Identifiants supérieurs à `email_id`, dans l'ordre de la boîte.
+        Le coût ne dépend que du nombre de courriels retournés.
+        """
+        position = bisect.bisect_left(self._ids, (email_id + 1,))
+        newer = [self._emails[newer_id] for _, newer_id in self._ids[position:]]
+        newer.sort(key=lambda email: (email.mtime, email.email_id), reverse=True)
+        return [email.email_id for email in newer]
+
+    def rank(self, email: IndexedEmail) -> int:
+        """Numéro du courriel dans la boîte (1 pour le plus récent)."""
+        return len(self._order) - bisect.bisect_left(
+            self._order, (email.mtime, email.email_id))
+
+    def search(self, sender: str = "", subject: str = "", terms: str = "",
+               date_from: Optional[float] = None,
+               date_to: Optional[float] = None) -> set[str]:
+        """
+        Retourne les identifiants des courriels satisfaisant tous les
+        critères fournis. Les termes du sujet et du corps doivent tous
+        être présents.
+        """
+        candidates: list[set[str]] = []
+        if sender:
+            candidates.append(self._senders.get(sender.lower(), set()))
+        for term in tokenize(subject):
+            candidates.append(self._subject_terms.get(term, set()))
+        for term in tokenize(terms):
+            candidates.append(self._body_terms.get(term, set()))
+        if date_from is not None or date_to is not None:
+            low = 0 if date_from is None else bisect.bisect_left(
+                self._dates, (date_from,))
+            high = len(self._dates) if date_to is None else bisect.bisect_right(
+                self._dates, (date_to, "\uffff"))
+            candidates.append({email_id for _, email_id
+                               in self._dates[low:high]})
+        if not candidates:
+            return set()
+        candidates.sort(key=len)
+        return {email_id for email_id
+                in candidates[0].intersection(*candidates[1:])
+                if email_id in self._emails}
+
+    def page(self, email_ids: set[str], page: int,
+             page_size: int) -> list[IndexedEmail]:
+        """Retourne la page demandée des résultats, du plus récent au plus ancien."""
+        newest = heapq.nlargest(page * page_size, (self._emails[email_id]
+                                                   for email_id in email_ids),
+                                key=lambda email: (email.mtime, email.email_id))
+        return newest[(page - 1) * page_size:]
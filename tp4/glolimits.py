@@ -0,0 +1,83 @@
+"""\
+Module fournissant les limiteurs de débit (seaux à jetons)
+utilisés par le serveur.
+"""
+import time
+from typing import Hashable, Optional
+
+
+def parse_rate(value: str) -> tuple[float, float]:
+    """
+    Lit une limite au format `débit/rafale` (ex. `20/40`: 20 requêtes
+    par seconde, rafales de 40). Lève ValueError si le format est invalide.
+    """
+    rate, _, burst = value.partition("/")
+    rate = float(rate)
+    return rate, float(burst) if burst else rate
+
+
+class TokenBucket:
+    """
+    Seau à jetons: se remplit de `rate` jetons par seconde jusqu'à
+    `capacity`; chaque requête consomme un jeton.
+    """
+
+    __slots__ = ("rate", "capacity", "_tokens", "_updated")
+
+    def __init__(self, rate: float, capacity: float,
+                 now: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic() if now is None else now
+
+    def consume(self, now: float, tokens: float = 1.0) -> bool:
+        """Consomme des jetons si possible; retourne False sinon."""
+        available = self._tokens + (now - self._updated) * self.rate
+        if available > self.capacity:
+            available = self.capacity
+        self._updated = now
+        if available < tokens:
+            self._tokens = available
+            return False
+        self._tokens = available - tokens
+        return True
+
+    def full(self, now: float) -> bool:
+        """Indique si le seau s'est rempli: il équivaut alors à un seau neuf."""
+        return self._tokens + (now - self._updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """
+    Ensemble de seaux à jetons indexés par une clé (socket, utilisateur),
+    créés à la première requête. Un débit nul désactive la limite.
+
+    Les seaux pleins sont oubliés une fois par durée de remplissage: seules
+    les clés actives pendant cette durée restent en mémoire.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets: dict[Hashable, TokenBucket] = {}
+        self._next_prune = 0.0
+
+    def allow(self, key: Hashable, now: float) -> bool:
+        if self.rate <= 0:
+            return True
+        if now >= self._next_prune:
+            self._prune(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity, now)
+            self._buckets[key] = bucket
+        return bucket.consume(now)
+
+    def _prune(self, now: float) -> None:
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if not bucket.full(now)}
+        self._next_prune = now + self.capacity / self.rate
+
+    def forget(self, key: Hashable) -> None:
+        self._buckets.pop(key, None)
@@ -0,0 +1,339 @@
+"""\
+Module fournissant l'instrumentation du serveur: métriques au format
+texte Prometheus, profileur échantillonneur optionnel et journalisation
+tamponnée.
+"""
+import bisect
+import collections
+import logging
+import logging.handlers
+import socket
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(label_name: Optional[str], label_value: Optional[str],
+                   extra: str = "") -> str:
+    parts = []
+    if label_name is not None and label_value is not None:
+        parts.append(f'{label_name}="{label_value}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Compteur monotone, optionnellement indexé par une étiquette."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str,
+                 label: Optional[str] = None) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values: dict[Optional[str], float] = {}
+
+    def inc(self, amount: float = 1, label_value: Optional[str] = None) -> None:
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def value(self, label_value: Optional[str] = None) -> float:
+        return self._values.get(label_value, 0)
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.label, key)} {value}"
+                for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Valeur instantanée pouvant monter ou descendre."""
+
+    kind = "gauge"
+
+    def set(self, value: float, label_value: Optional[str] = None) -> None:
+        self._values[label_value] = value
+
+
+class Histogram:
+    """Histogramme cumulatif à seaux fixes."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str,
+                 label: Optional[str] = None,
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._buckets = buckets
+        # label -> [compte par seau..., +Inf, somme]
+        self._values: dict[Optional[str], list[float]] = {}
+
+    def observe(self, value: float, label_value: Optional[str] = None) -> None:
+        series = self._values.get(label_value)
+        if series is None:
+            series = [0] * (len(self._buckets) + 2)
+            self._values[label_value] = series
+        series[bisect.bisect_left(self._buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, label_value: Optional[str] = None) -> "_Timer":
+        """Gestionnaire de contexte mesurant la durée du bloc."""
+        return _Timer(self, label_value)
+
+    def count(self, label_value: Optional[str] = None) -> int:
+        series = self._values.get(label_value)
+        return int(sum(series[:-1])) if series else 0
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, series in self._values.items():
+            cumulative = 0
+            for bound, hits in zip(self._buckets, series):
+                cumulative += hits
+                labels = _format_labels(self.label, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += series[-2]
+            labels = _format_labels(self.label, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_label_value", "_start")
+
+    def __init__(self, histogram: Histogram,
+                 label_value: Optional[str]) -> None:
+        self._histogram = histogram
+        self._label_value = label_value
+        self._start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._histogram.observe(time.perf_counter() - self._start,
+                                self._label_value)
+
+
+class MetricsRegistry:
+    """Regroupe les métriques et les rend au format texte Prometheus."""
+
+    def __init__(self) -> None:
+        self._metrics: list = []
+
+    def counter(self, name: str, help_text: str,
+                label: Optional[str] = None) -> Counter:
+        return self._register(Counter(name, help_text, label))
+
+    def gauge(self, name: str, help_text: str,
+              label: Optional[str] = None) -> Gauge:
+        return self._register(Gauge(name, help_text, label))
+
+    def histogram(self, name: str, help_text: str,
+                  label: Optional[str] = None) -> Histogram:
+        return self._register(Histogram(name, help_text, label))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Profileur échantillonneur: un fil d'exécution relève périodiquement
+    la pile du fil principal et compte les piles rencontrées.
+
+    Le rendu suit le format « collapsed stacks » des flamegraphs.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self._interval = interval
+        self._target = threading.main_thread().ident
+        self._samples: collections.Counter = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._sample_loop,
+                                        name="glo-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self._samples[";".join(reversed(stack))] += 1
+
+    def render(self) -> str:
+        return "".join(f"{stack} {count}\n"
+                       for stack, count in self._samples.most_common())
+
+
+HTTP_TIMEOUT = 5.0
+HTTP_MAX_REQUEST = 8192
+
+
+def render_http(request: bytes, routes: dict) -> bytes:
+    """
+    Construit la réponse à une requête HTTP minimale. `routes` associe
+    un chemin à une fonction produisant le corps de la réponse.
+    """
+    parts = request.decode("latin-1").split(" ", 2)
+    path = parts[1] if len(parts) > 1 else "/"
+    render = routes.get(path)
+    if render is None:
+        status, body = "404 Not Found", "not found\n"
+    else:
+        status, body = "200 OK", render()
+    data = body.encode("utf-8")
+    return (f"HTTP/1.0 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n").encode("latin-1") + data
+
+
+class HTTPConnection:
+    """
+    Connexion non bloquante au point d'accès des métriques, avancée par
+    la boucle du serveur: la requête est lue puis la réponse écrite au
+    fil des événements de select, sans jamais attendre le client.
+    """
+
+    def __init__(self, sock: socket.socket, now: float) -> None:
+        sock.setblocking(False)
+        self.sock = sock
+        self.deadline = now + HTTP_TIMEOUT
+        self._request = b""
+        self._response = b""
+
+    @property
+    def wants_write(self) -> bool:
+        return bool(self._response)
+
+    def on_readable(self, routes: Callable[[], dict]) -> bool:
+        """
+        Lit la requête; une fois la première ligne reçue, prépare la
+        réponse avec `routes()`. Retourne False si la connexion est finie.
+        """
+        try:
+            chunk = self.sock.recv(1024)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        if not chunk:
+            return False
+        self._request += chunk
+        if b"\n" not in self._request:
+            return len(self._request) < HTTP_MAX_REQUEST
+        self._response = render_http(self._request, routes())
+        return self.on_writable()
+
+    def on_writable(self) -> bool:
+        """Écrit la réponse autant que possible; retourne False une fois terminée."""
+        try:
+            sent = self.sock.send(self._response)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        self._response = self._response[sent:]
+        return bool(self._response)
+
+
+class TimedMemoryHandler(logging.handlers.MemoryHandler):
+    """
+    Tampon du journal qui se vide aussi quand sa plus ancienne entrée
+    attend depuis `interval` secondes, pour qu'un serveur peu actif
+    n'accumule pas ses entrées indéfiniment.
+    """
+
+    def __init__(self, capacity: int, flushLevel: int,
+                 target: logging.Handler, interval: float) -> None:
+        super().__init__(capacity, flushLevel=flushLevel, target=target)
+        self.interval = interval
+        self._oldest: Optional[float] = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        super().emit(record)
+
+    def flush(self) -> None:
+        super().flush()
+        self._oldest = None
+
+    def shouldFlush(self, record: logging.LogRecord) -> bool:
+        return super().shouldFlush(record) or self.delay() == 0.0
+
+    def delay(self) -> Optional[float]:
+        """Délai avant la prochaine écriture due, None si le tampon est vide."""
+        if self._oldest is None:
+            return None
+        return max(0.0, self._oldest + self.interval - time.monotonic())
+
+
+def configure_logging(name: str, level: str,
+                      flush_interval: float) -> logging.Logger:
+    """
+    Prépare un journal tamponné: les entrées sont accumulées en mémoire
+    et écrites par lots, immédiatement à partir du niveau WARNING, ou
+    au plus tard `flush_interval` secondes après avoir été émises (voir
+    `logging_delay`).
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level.upper())
+    logger.propagate = False
+    if not logger.handlers:
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(message)s"))
+        logger.addHandler(TimedMemoryHandler(
+            capacity=256, flushLevel=logging.WARNING, target=stream,
+            interval=flush_interval))
+    return logger
+
+
+def logging_delay(logger: logging.Logger) -> Optional[float]:
+    """
+    Délai avant que des entrées en attente doivent être écrites, None
+    s'il n'y en a aucune. La boucle du serveur attend au plus ce délai
+    puis appelle `flush_logging`.
+    """
+    delays = [handler.delay() for handler in logger.handlers
+              if isinstance(handler, TimedMemoryHandler)]
+    delays = [delay for delay in delays if delay is not None]
+    return min(delays) if delays else None
+
+
+def flush_logging(logger: logging.Logger) -> None:
+    """Vide les tampons du journal."""
+    for handler in logger.handlers:
+        handler.flush()
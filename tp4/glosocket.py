@@ -3,6 +3,7 @@ Module fournissant les fonctions d'envoi et de réception
 de messages de taille arbitraire pour les sockets Python.
 """
 import socket
+import ssl
 import struct
 
 
@@ -20,9 +21,9 @@ def _recvall(source: socket.socket, size: int) -> bytes:
     Applique socket.recv en boucle pour jusqu'à la
     réception d'un message de la taille voulue.
     """
-    msg = b""
+    msg = bytearray()
     while size > 0:
-        chunk_size = min(size, 4096)
+        chunk_size = min(size, 65536)
         try:
             buffer = source.recv(chunk_size)
         except OSError as ex:
@@ -31,22 +32,69 @@ def _recvall(source: socket.socket, size: int) -> bytes:
             raise GLOSocketError("The other socket is closed.")
         msg += buffer
         size -= len(buffer)
-    return msg
+    return bytes(msg)
 
 
-def send_mesg(dest_soc: socket.socket, message: str) -> None:
+def encode_mesg(message: str) -> bytes:
+    """Encode le message, précédé de sa taille, tel que transmis."""
+    data = message.encode(encoding='utf-8')
+    return struct.pack("!I", len(data)) + data
+
+
+def send_mesg(dest_soc: socket.socket, message: str) -> int:
     """
     Encode le message puis le transmet à la destination.
+    Retourne le nombre d'octets transmis.
 
     Lève une exception GLOSocketError en cas de problème
     de communication.
     """
-    data = message.encode(encoding='utf-8')
-    data_length = struct.pack("!I", len(data))
+    data = encode_mesg(message)
     try:
-        dest_soc.sendall(data_length + data)
+        dest_soc.sendall(data)
     except OSError as ex:
         raise GLOSocketError("Cannot send data with socket") from ex
+    return len(data)
+
+
+def send_available(dest_soc: socket.socket, data: bytes) -> int:
+    """
+    Transmet ce que le socket accepte de `data` sans bloquer, même si
+    le socket est bloquant. Retourne le nombre d'octets transmis.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    try:
+        if not isinstance(dest_soc, ssl.SSLSocket):
+            return dest_soc.send(data, socket.MSG_DONTWAIT)
+        # Un socket ssl refuse les drapeaux: il passe temporairement
+        # en mode non bloquant.
+        blocking = dest_soc.getblocking()
+        dest_soc.setblocking(False)
+        try:
+            return dest_soc.send(data)
+        finally:
+            dest_soc.setblocking(blocking)
+    except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+        return 0
+    except OSError as ex:
+        raise GLOSocketError("Cannot send data with socket") from ex
+
+
+def decode_mesgs(buffer: bytearray) -> list[str]:
+    """
+    Retire de `buffer` les messages complets qu'il contient et les
+    retourne décodés; un message partiel y reste jusqu'à la suite.
+    """
+    messages = []
+    while len(buffer) >= 4:
+        length, = struct.unpack_from("!I", buffer)
+        if len(buffer) < length + 4:
+            break
+        messages.append(buffer[4:length + 4].decode('utf-8'))
+        del buffer[:length + 4]
+    return messages
 
 
 def recv_mesg(source_soc: socket.socket) -> str:
@@ -56,6 +104,14 @@ def recv_mesg(source_soc: socket.socket) -> str:
     Lève une exception GLOSocketError en cas de problème
     de communication.
     """
+    message, _ = recv_mesg_sized(source_soc)
+    return message
+
+
+def recv_mesg_sized(source_soc: socket.socket) -> tuple[str, int]:
+    """
+    Comme recv_mesg, mais retourne aussi le nombre d'octets reçus.
+    """
     data_length = _recvall(source_soc, 4)
     try:
         length, = struct.unpack("!I", data_length)
@@ -64,4 +120,4 @@ def recv_mesg(source_soc: socket.socket) -> str:
                              " not the message's length") from ex
 
     data = _recvall(source_soc, length)
-    return data.decode('utf-8')
+    return data.decode('utf-8'), length + 4
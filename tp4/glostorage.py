@@ -0,0 +1,476 @@
+"""\
+Module fournissant la résolution des chemins du dossier de données
+du serveur.
+
+Disposition:
+    <racine>/USERS/<h0h1>/<h2h3>/<utilisateur>/pass.txt
+    <racine>/USERS/<h0h1>/<h2h3>/<utilisateur>/deleted.log
+    <racine>/USERS/<h0h1>/<h2h3>/<utilisateur>/<seau>/<id>.json
+    <racine>/USERS/<h0h1>/<h2h3>/<utilisateur>/<seau>/<id>.body
+    <racine>/LOST/<seau>/<id>.json
+    <racine>/ARCHIVE/<AAAA-MM>/<id>.json
+    <racine>/BODIES/<c0c1>/<condensé>[.<génération>].body
+
+où h0h1h2h3 sont les premiers caractères du hachage du nom
+d'utilisateur et <seau> est dérivé du hachage de l'identifiant du
+courriel. Le corps d'un courriel n'est écrit qu'une fois dans BODIES,
+sous son condensé SHA-256; l'entrée <id>.json de chaque destinataire ne
+conserve que les entêtes, la taille logique et la référence au corps,
+et <id>.body est un lien physique vers ce corps. Un corps ayant atteint
+le nombre maximal de liens du système de fichiers est recopié sous une
+nouvelle génération. deleted.log journalise
+les identifiants supprimés, pour la synchronisation des caches clients.
+
+L'ancienne disposition à plat (<racine>/<utilisateur>/<id>.json) est
+migrée à la volée, ou en entier avec:
+
+    python glostorage.py [dossier]
+"""
+import errno
+import hashlib
+import json
+import os
+import secrets
+import sys
+import time
+import zlib
+from typing import Iterator, Optional
+
+import gloutils
+
+USERS_DIR = "USERS"
+ARCHIVE_DIR = "ARCHIVE"
+BODIES_DIR = "BODIES"
+RESERVED_DIRS = (USERS_DIR, ARCHIVE_DIR, BODIES_DIR, gloutils.SERVER_LOST_DIR)
+EMAIL_BUCKETS = 16
+LOST_BUCKETS = 256
+EMAIL_EXTENSION = ".json"
+BODY_EXTENSION = ".body"
+REPLICATION_FILENAME = "replication.json"
+REPLICATION_LOG_FILENAME = "replication.log"
+DELETIONS_FILENAME = "deleted.log"
+DELETIONS_MAX_BYTES = 64 * 1024
+
+
+class Storage:
+    """Couche unique de résolution des chemins du serveur."""
+
+    def __init__(self, root: str = gloutils.SERVER_DATA_DIR) -> None:
+        self.root = root
+        self.users_root = os.path.join(root, USERS_DIR)
+        self.lost_root = os.path.join(root, gloutils.SERVER_LOST_DIR)
+        self.archive_root = os.path.join(root, ARCHIVE_DIR)
+        self.bodies_root = os.path.join(root, BODIES_DIR)
+        self.replication_path = os.path.join(root, REPLICATION_FILENAME)
+        self.replication_log_path = os.path.join(root, REPLICATION_LOG_FILENAME)
+        self.last_email_id = 0
+        self._body_generations: dict[str, int] = {}
+
+    def validate(self) -> None:
+        """S'assure que les dossiers de données existent."""
+        for directory in (self.root, self.users_root, self.lost_root,
+                          self.bodies_root):
+            os.makedirs(directory, exist_ok=True)
+
+    def new_email_id(self) -> str:
+        """
+        Génère un identifiant de courriel unique pour ce processus,
+        basé sur l'heure en millisecondes. En rafale, les identifiants
+        devancent l'horloge: un remplaçant reprend `last_email_id` de
+        son prédécesseur pour ne pas en réattribuer.
+        """
+        email_id = max(int(time.time() * 1000), self.last_email_id + 1)
+        self.last_email_id = email_id
+        return str(email_id)
+
+    @staticmethod
+    def _bucket(email_id: str, buckets: int) -> str:
+        return f"{zlib.crc32(email_id.encode('utf-8')) % buckets:02x}"
+
+    def user_dir(self, username: str) -> str:
+        digest = hashlib.sha1(username.encode("utf-8")).hexdigest()
+        return os.path.join(self.users_root, digest[:2], digest[2:4], username)
+
+    def _legacy_user_dir(self, username: str) -> str:
+        return os.path.join(self.root, username)
+
+    def has_user(self, username: str) -> bool:
+        """
+        Vérifie que l'utilisateur existe. Un compte encore dans l'ancienne
+        disposition est migré à cette occasion.
+        """
+        if os.path.isdir(self.user_dir(username)):
+            return True
+        legacy_dir = self._legacy_user_dir(username)
+        # Seul un dossier directement sous la racine est un ancien compte:
+        # ni `.`, ni `..`, ni un lien menant ailleurs, ni un dossier de
+        # données du serveur (`users` désigne `USERS` si la casse est ignorée).
+        if os.path.dirname(os.path.realpath(legacy_dir)) != os.path.realpath(self.root):
+            return False
+        if username.upper() in RESERVED_DIRS:
+            reserved_dir = os.path.join(self.root, username.upper())
+            if os.path.isdir(legacy_dir) and os.path.isdir(reserved_dir) \
+                    and os.path.samefile(legacy_dir, reserved_dir):
+                return False
+        if os.path.isdir(legacy_dir):
+            self.migrate_user(username)
+            return True
+        return False
+
+    def create_user(self, username: str) -> None:
+        os.makedirs(self.user_dir(username))
+
+    def password_path(self, username: str) -> str:
+        return os.path.join(self.user_dir(username),
+                            f"{gloutils.PASSWORD_FILENAME}.txt")
+
+    def email_path(self, username: str, email_id: str) -> str:
+        return os.path.join(self.user_dir(username),
+                            self._bucket(email_id, EMAIL_BUCKETS),
+                            email_id + EMAIL_EXTENSION)
+
+    def deletions_path(self, username: str) -> str:
+        return os.path.join(self.user_dir(username), DELETIONS_FILENAME)
+
+    def lost_path(self, email_id: str) -> str:
+        return os.path.join(self.lost_root,
+                            self._bucket(email_id, LOST_BUCKETS),
+                            email_id + EMAIL_EXTENSION)
+
+    def archive_path(self, email_id: str, mtime: float) -> str:
+        month = time.strftime("%Y-%m", time.gmtime(mtime))
+        return os.path.join(self.archive_root, month,
+                            email_id + EMAIL_EXTENSION)
+
+    def body_path(self, name: str) -> str:
+        return os.path.join(self.bodies_root, name[:2], name + BODY_EXTENSION)
+
+    @staticmethod
+    def _link_path(path: str) -> str:
+        return path[:-len(EMAIL_EXTENSION)] + BODY_EXTENSION
+
+    def iter_users(self) -> Iterator[str]:
+        """Énumère les noms des comptes, sans les charger en mémoire."""
+        for first in os.scandir(self.users_root):
+            if not first.is_dir():
+                continue
+            for second in os.scandir(first.path):
+                if not second.is_dir():
+                    continue
+                for user in os.scandir(second.path):
+                    if user.is_dir():
+                        yield user.name
+
+    def iter_lost(self) -> Iterator[tuple[str, str]]:
+        """Énumère les paires (identifiant, chemin) des courriels perdus."""
+        for bucket in os.scandir(self.lost_root):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith(EMAIL_EXTENSION):
+                    yield entry.name[:-len(EMAIL_EXTENSION)], entry.path
+
+    def lost_size(self) -> int:
+        """Retourne la taille totale des courriels perdus."""
+        size = 0
+        for _, path in self.iter_lost():
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def iter_bodies(self) -> Iterator[str]:
+        """Énumère les chemins des corps de courriels."""
+        for prefix in os.scandir(self.bodies_root):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.name.endswith(BODY_EXTENSION):
+                    yield entry.path
+
+    def prune_buckets(self, username: str) -> None:
+        """Supprime les seaux vides d'un compte."""
+        for entry in os.scandir(self.user_dir(username)):
+            if entry.is_dir():
+                try:
+                    os.rmdir(entry.path)
+                except OSError:
+                    pass
+
+    def iter_emails(self, username: str) -> Iterator[tuple[str, str]]:
+        """Énumère les paires (identifiant, chemin) des courriels de l'utilisateur."""
+        user_dir = self.user_dir(username)
+        try:
+            buckets = [entry for entry in os.scandir(user_dir) if entry.is_dir()]
+        except FileNotFoundError:
+            return
+        for bucket in buckets:
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith(EMAIL_EXTENSION):
+                    yield entry.name[:-len(EMAIL_EXTENSION)], entry.path
+
+    @staticmethod
+    def write(path: str, data: bytes) -> None:
+        """Écrit un fichier en créant au besoin son seau."""
+        try:
+            file = open(path, "wb")
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            file = open(path, "wb")
+        with file:
+            file.write(data)
+
+    def _start_deletions(self, path: str) -> bytes:
+        """Recommence le journal des suppressions sous une nouvelle génération."""
+        header = secrets.token_hex(8).encode("ascii") + b"\n"
+        temporary = path + ".tmp"
+        self.write(temporary, header)
+        os.replace(temporary, path)
+        return header
+
+    def record_deletion(self, username: str, email_id: str) -> None:
+        """
+        Journalise la suppression d'un courriel. Au-delà de
+        DELETIONS_MAX_BYTES, le journal recommence sous une nouvelle
+        génération et les clients en retard se resynchronisent en entier.
+        """
+        path = self.deletions_path(username)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = None
+        if size is None or size >= DELETIONS_MAX_BYTES:
+            self._start_deletions(path)
+        with open(path, "ab") as file:
+            file.write(email_id.encode("ascii") + b"\n")
+
+    def deletions_since(self, username: str, generation: str,
+                        offset: int) -> tuple[str, int, Optional[list[str]]]:
+        """
+        Retourne la génération du journal des suppressions, sa taille et
+        les identifiants supprimés depuis la position `offset` de la
+        génération `generation`. La liste vaut None si cette position
+        n'existe plus: le journal a été recommencé depuis.
+        """
+        path = self.deletions_path(username)
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            header = self._start_deletions(path)
+            return header.decode("ascii").strip(), len(header), None
+        with file:
+            header = file.readline()
+            current = header.decode("ascii").strip()
+            end = file.seek(0, os.SEEK_END)
+            if current != generation or not len(header) <= offset <= end:
+                return current, end, None
+            file.seek(offset)
+            deleted = file.read().decode("ascii").split()
+        return current, end, deleted
+
+    def write_email(self, path: str, payload: dict, size: int) -> bool:
+        """
+        Écrit le courriel `payload` à `path`. Le corps n'est écrit que
+        s'il est absent de BODIES; sinon la livraison se résume à un lien
+        physique et à une petite entrée. Le nombre de liens du corps sert
+        ainsi de compteur de références, tenu à jour par le système de
+        fichiers. `size` est la taille logique du courriel sérialisé.
+
+        Lorsque le corps atteint le nombre maximal de liens (EMLINK), la
+        livraison passe à une nouvelle génération `<condensé>.<n>`, copie
+        indépendante du même corps; l'entrée référence la génération liée.
+
+        Retourne vrai si le corps a dû être écrit, faux s'il était déjà
+        présent.
+        """
+        body = payload["content"].encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()
+        link_path = self._link_path(path)
+        generation = self._body_generations.get(digest, 0)
+        written = False
+        while True:
+            name = f"{digest}.{generation}" if generation else digest
+            body_path = self.body_path(name)
+            if not os.path.exists(body_path):
+                self.write(body_path + ".tmp", body)
+                os.replace(body_path + ".tmp", body_path)
+                written = True
+            try:
+                self._link(body_path, link_path)
+                break
+            except OSError as ex:
+                if ex.errno != errno.EMLINK:
+                    raise
+            generation += 1
+            self._body_generations[digest] = generation
+        entry = {field: value for field, value in payload.items()
+                 if field != "content"}
+        entry.update(body=name, size=size)
+        try:
+            self.write(path, json.dumps(entry).encode("utf-8"))
+        except OSError:
+            self._release_body(link_path, body_path)
+            raise
+        return written
+
+    def read_body(self, digest: str) -> Optional[str]:
+        """
+        Retourne le corps de condensé `digest` s'il est présent dans
+        BODIES, quelle que soit sa génération, ou None.
+        """
+        try:
+            with open(self.body_path(digest), "r", encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            pass
+        try:
+            entries = list(os.scandir(os.path.dirname(self.body_path(digest))))
+        except FileNotFoundError:
+            return None
+        for entry in entries:
+            if entry.name.startswith(digest + ".") \
+                    and entry.name.endswith(BODY_EXTENSION):
+                try:
+                    with open(entry.path, "r", encoding="utf-8") as file:
+                        return file.read()
+                except FileNotFoundError:
+                    continue
+        return None
+
+    @staticmethod
+    def _link(body_path: str, link_path: str) -> None:
+        try:
+            os.link(body_path, link_path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(link_path), exist_ok=True)
+            os.link(body_path, link_path)
+
+    def read_email(self, path: str, with_body: bool = True) -> tuple[dict, int]:
+        """
+        Lit le courriel à `path` et retourne son contenu et sa taille
+        logique. Sans `with_body`, seule l'entrée est lue et le champ
+        `content` est absent. Les courriels complets de l'ancien format
+        sont lus tels quels.
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            entry = json.load(file)
+        if "body" not in entry:
+            return entry, os.path.getsize(path)
+        del entry["body"]
+        size = entry.pop("size")
+        if with_body:
+            with open(self._link_path(path), "r", encoding="utf-8") as file:
+                entry["content"] = file.read()
+        return entry, size
+
+    def remove_email(self, path: str) -> int:
+        """
+        Supprime le courriel à `path` et libère sa référence au corps,
+        qui est supprimé s'il n'est plus référencé. Retourne la taille
+        logique du courriel.
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            try:
+                entry = json.load(file)
+            except ValueError:
+                entry = {}
+        if "body" not in entry:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        os.remove(path)
+        self._release_body(self._link_path(path), self.body_path(entry["body"]))
+        return entry["size"]
+
+    @staticmethod
+    def _release_body(link_path: str, body_path: str) -> None:
+        try:
+            os.remove(link_path)
+        except FileNotFoundError:
+            pass
+        collect_body(body_path)
+
+    def migrate_user(self, username: str) -> None:
+        """
+        Déplace un compte de l'ancienne disposition vers la nouvelle et
+        répartit ses courriels dans les seaux. L'opération peut être
+        reprise si elle a été interrompue.
+        """
+        legacy_dir = self._legacy_user_dir(username)
+        user_dir = self.user_dir(username)
+        if os.path.isdir(legacy_dir) and not os.path.isdir(user_dir):
+            self._move(legacy_dir, user_dir)
+        for entry in list(os.scandir(user_dir)):
+            if entry.is_file() and entry.name.endswith(EMAIL_EXTENSION):
+                email_id = entry.name[:-len(EMAIL_EXTENSION)]
+                self._move(entry.path, self.email_path(username, email_id))
+
+    def migrate_lost(self) -> int:
+        """Répartit les courriels perdus à plat dans les seaux."""
+        moved = 0
+        for entry in list(os.scandir(self.lost_root)):
+            if entry.is_file() and entry.name.endswith(EMAIL_EXTENSION):
+                email_id = entry.name[:-len(EMAIL_EXTENSION)]
+                self._move(entry.path, self.lost_path(email_id))
+                moved += 1
+        return moved
+
+    def migrate_all(self) -> int:
+        """
+        Migre tous les comptes de l'ancienne disposition, un à la fois,
+        ce qui permet de l'exécuter pendant que le serveur tourne.
+        Retourne le nombre de comptes migrés.
+        """
+        self.validate()
+        migrated = 0
+        for entry in list(os.scandir(self.root)):
+            if entry.name in RESERVED_DIRS or not entry.is_dir():
+                continue
+            self.migrate_user(entry.name)
+            migrated += 1
+        self.migrate_lost()
+        return migrated
+
+    def move(self, source: str, destination: str) -> None:
+        """Déplace un fichier en créant au besoin son dossier de destination."""
+        self._move(source, destination)
+
+    @staticmethod
+    def _move(source: str, destination: str) -> None:
+        """Déplace un fichier ou un dossier, sauf s'il l'a déjà été entre-temps."""
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        try:
+            os.rename(source, destination)
+        except FileNotFoundError:
+            pass
+
+
+def body_digest(content: str) -> str:
+    """Condensé sous lequel un corps est rangé dans BODIES."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def collect_body(path: str) -> bool:
+    """
+    Supprime le corps à `path` s'il n'est plus référencé par aucune
+    boîte, c'est-à-dire si son seul lien restant est celui de BODIES.
+    """
+    try:
+        if os.stat(path).st_nlink > 1:
+            return False
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _main() -> int:
+    root = sys.argv[1] if len(sys.argv) > 1 else gloutils.SERVER_DATA_DIR
+    migrated = Storage(root).migrate_all()
+    print(f"{migrated} compte(s) migré(s) dans {root}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
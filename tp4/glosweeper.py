@@ -0,0 +1,137 @@
+"""\
+Module fournissant le balayeur de rétention du serveur: expiration
+des courriels, purge ou archivage du dossier LOST, collecte des corps
+orphelins et compactage des index, exécutés par petites étapes pendant les temps morts de la boucle.
+"""
+import os
+import time
+from typing import Callable, Iterator, NamedTuple, Optional
+
+import gloindex
+import glostorage
+
+DAY = 24 * 60 * 60
+
+
+class RetentionPolicy(NamedTuple):
+    """Politique de rétention; une durée nulle désactive la règle."""
+    email_days: float
+    lost_days: float
+    archive_lost: bool
+
+
+class Sweeper:
+    """
+    Balayeur incrémental. Un cycle complet est découpé en étapes
+    élémentaires (un fichier, une liste de termes) exécutées par
+    `step` dans un budget de temps fixe.
+
+    `expire_email(username, email_id, path)` est appelée pour chaque
+    courriel expiré, afin que le serveur tienne ses compteurs et ses
+    index à jour. `on_swept(kind, size)` est appelée pour chaque fichier
+    traité, avec sa taille pour les courriels perdus (0 sinon).
+    """
+
+    def __init__(self, storage: glostorage.Storage, policy: RetentionPolicy,
+                 expire_email: Callable[[str, str, str], None],
+                 indexes: dict[str, gloindex.MailboxIndex],
+                 interval: float, budget: float, max_delay: float,
+                 on_swept: Optional[Callable[[str, int], None]] = None) -> None:
+        self._storage = storage
+        self._policy = policy
+        self._expire_email = expire_email
+        self._indexes = indexes
+        self._interval = interval
+        self._budget = budget
+        self._max_delay = max_delay
+        self._on_swept = on_swept or (lambda kind, size: None)
+        self._task: Optional[Iterator[None]] = None
+        self._next_cycle = time.monotonic()
+        self._last_step = time.monotonic()
+
+    def idle_timeout(self) -> float:
+        """Délai d'attente maximal de la boucle avant la prochaine étape."""
+        if self._task is not None:
+            return 0.01
+        return max(0.0, self._next_cycle - time.monotonic())
+
+    def maybe_step(self, idle: bool) -> None:
+        """
+        Exécute une étape si la boucle est inactive, ou si aucune étape
+        n'a pu s'exécuter depuis `max_delay` secondes sous charge.
+        """
+        now = time.monotonic()
+        if self._task is None and now < self._next_cycle:
+            return
+        if idle or now - self._last_step >= self._max_delay:
+            self.step(now)
+
+    def step(self, now: float) -> None:
+        if self._task is None:
+            self._task = self._cycle()
+        self._last_step = now
+        deadline = now + self._budget
+        try:
+            while time.monotonic() < deadline:
+                next(self._task)
+        except StopIteration:
+            self._task = None
+            self._next_cycle = time.monotonic() + self._interval
+
+    def _cycle(self) -> Iterator[None]:
+        now = time.time()
+        if self._policy.email_days > 0:
+            yield from self._sweep_mailboxes(now - self._policy.email_days * DAY)
+        if self._policy.lost_days > 0:
+            yield from self._sweep_lost(now - self._policy.lost_days * DAY)
+        yield from self._sweep_bodies()
+        for index in list(self._indexes.values()):
+            if index.stale:
+                yield from index.compact()
+
+    def _sweep_mailboxes(self, cutoff: float) -> Iterator[None]:
+        for username in self._storage.iter_users():
+            expired = False
+            for email_id, path in self._storage.iter_emails(username):
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if mtime < cutoff:
+                    self._expire_email(username, email_id, path)
+                    self._on_swept("expired", 0)
+                    expired = True
+                yield
+            if expired:
+                self._storage.prune_buckets(username)
+            yield
+
+    def _sweep_lost(self, cutoff: float) -> Iterator[None]:
+        for email_id, path in self._storage.iter_lost():
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime < cutoff:
+                    if self._policy.archive_lost:
+                        self._storage.move(path, self._storage.archive_path(
+                            email_id, stat.st_mtime))
+                        self._on_swept("lost_archived", stat.st_size)
+                    else:
+                        os.remove(path)
+                        self._on_swept("lost_purged", stat.st_size)
+            except OSError:
+                pass
+            yield
+
+    def _sweep_bodies(self) -> Iterator[None]:
+        """
+        Collecte les corps qu'aucune boîte ne référence plus. Ils sont
+        normalement supprimés avec leur dernière référence; il ne reste
+        ici que ceux laissés par une livraison interrompue.
+        """
+        for path in self._storage.iter_bodies():
+            try:
+                if glostorage.collect_body(path):
+                    self._on_swept("bodies_collected", 0)
+            except OSError:
+                pass
+            yield
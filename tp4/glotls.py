@@ -0,0 +1,73 @@
+"""\
+Module fournissant le chiffrement TLS optionnel des connexions.
+Le tramage de glosocket est inchangé: les messages circulent
+simplement dans un socket ssl.
+
+Un client conserve la session TLS de chaque serveur et la présente à
+la reconnexion; le serveur la reprend à partir de son ticket, sans
+échange de clés ni vérification de certificat. Les clés des tickets
+sont propres au processus serveur: après un redémarrage, la première
+reconnexion refait une poignée de main complète.
+"""
+import select
+import socket
+import ssl
+from typing import Optional
+
+
+def server_context(certfile: str, keyfile: Optional[str] = None) -> ssl.SSLContext:
+    """Contexte serveur; lève OSError ou ssl.SSLError si le certificat est invalide."""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def client_context(cafile: Optional[str] = None) -> ssl.SSLContext:
+    """
+    Contexte client vérifiant le certificat du serveur à l'aide de
+    `cafile`, ou des autorités du système à défaut.
+    """
+    context = ssl.create_default_context(cafile=cafile)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    return context
+
+
+class TLSConnector:
+    """Établit les connexions TLS d'un client et conserve leurs sessions."""
+
+    def __init__(self, context: ssl.SSLContext) -> None:
+        self.context = context
+        self._sessions: dict[tuple[str, int], ssl.SSLSession] = {}
+
+    def wrap(self, sock: socket.socket, host: str, port: int,
+             do_handshake_on_connect: bool = True) -> ssl.SSLSocket:
+        """
+        Effectue la poignée de main sur `sock`, connecté à `host`, en
+        reprenant la dernière session avec ce serveur si elle existe.
+        Sans `do_handshake_on_connect`, l'appelant la mène lui-même avec
+        `do_handshake`, par exemple sur un socket non bloquant.
+        """
+        return self.context.wrap_socket(sock, server_hostname=host,
+                                        session=self._sessions.get((host, port)),
+                                        do_handshake_on_connect=do_handshake_on_connect)
+
+    def remember(self, sock: ssl.SSLSocket, host: str, port: int) -> None:
+        """
+        Conserve la session de `sock` avant sa fermeture. En TLS 1.3, le
+        ticket n'arrive qu'après la poignée de main: la session n'est
+        réutilisable qu'une fois une réponse du serveur lue.
+        """
+        session = sock.session
+        if session is not None and session.has_ticket:
+            self._sessions[(host, port)] = session
+
+
+def readable(sock: socket.socket, timeout: float) -> bool:
+    """
+    Indique si un message peut être lu. Un socket ssl peut conserver
+    des données déjà déchiffrées que select ne voit pas.
+    """
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        return True
+    return bool(select.select([sock], [], [], timeout)[0])
@@ -7,10 +7,40 @@ from typing import TypedDict, Union
 import datetime
 
 APP_PORT = 9673
+METRICS_PORT = 9674
 SERVER_DATA_DIR = "glo_server_data"
 SERVER_LOST_DIR = "LOST"
 SERVER_DOMAIN = "glo2000.ca"
+SEARCH_PAGE_SIZE = 20
+INDEX_CACHE_SIZE = 256
+USAGE_CACHE_SIZE = 65536
+USER_QUOTA_BYTES = 10 * 1024 * 1024
+MAX_MESSAGE_BYTES = 1024 * 1024
+LOST_QUOTA_BYTES = 100 * 1024 * 1024
+CONNECTION_RATE_LIMIT = "20/40"
+USER_RATE_LIMIT = "50/100"
+EMAIL_RETENTION_DAYS = 0
+LOST_RETENTION_DAYS = 30
+SWEEP_INTERVAL = 3600.0
+SWEEP_BUDGET = 0.005
+SWEEP_MAX_DELAY = 1.0
+INDEX_BUILD_BUDGET = 0.01
+HANDOFF_TIMEOUT = 10.0
+HANDOFF_DRAIN_TIMEOUT = 3600.0
+LOG_FLUSH_INTERVAL = 1.0
 PASSWORD_FILENAME = "pass"  # nosec:B105
+CLIENT_CACHE_DIR = ".glo_client_cache"
+REPLICATION_BATCH_SIZE = 200
+REPLICATION_BATCH_BYTES = 1024 * 1024
+REPLICATION_FLUSH_INTERVAL = 0.05
+REPLICATION_WINDOW = 4
+REPLICATION_BACKLOG = 10000
+REPLICATION_BACKLOG_BYTES = 64 * 1024 * 1024
+REPLICATION_TIMEOUT = 2.0
+REPLICATION_RETRY = 1.0
+TLS_HANDSHAKE_TIMEOUT = 10.0
+OUTBOX_MAX_BYTES = 1024 * 1024
+NEW_MAIL_SUBJECT_LENGTH = 200
 
 CLIENT_AUTH_CHOICE = """Menu de connexion
 1. Créer un compte
@@ -20,7 +50,8 @@ CLIENT_USE_CHOICES = """Menu principal
 1. Consultation de courriels
 2. Envoi de courriels
 3. Statistiques
-4. Se déconnecter"""
+4. Recherche de courriels
+5. Se déconnecter"""
 
 SUBJECT_DISPLAY = "#{number} {sender} - {subject} {date}"
 
@@ -32,6 +63,8 @@ Date : {date}
 {body}
 """
 
+NEW_MAIL_DISPLAY = "Nouveau courriel de {sender} - {subject} {date}"
+
 STATS_DISPLAY = """Nombre de messages : {count}
 Taille du dossier : {size} octets"""
 
@@ -55,6 +88,19 @@ class Headers(enum.IntEnum):
 
     STATS_REQUEST = enum.auto()
 
+    INBOX_SUBSCRIBE = enum.auto()
+    NEW_MAIL = enum.auto()
+
+    INBOX_SEARCH_REQUEST = enum.auto()
+
+    EMAIL_DELETION = enum.auto()
+
+    INBOX_SYNC_REQUEST = enum.auto()
+    EMAIL_FETCH = enum.auto()
+
+    REPLICATION_HELLO = enum.auto()
+    REPLICATION_BATCH = enum.auto()
+
 
 class ErrorPayload(TypedDict, total=True):
     """Payload pour les messages d'erreurs."""
@@ -86,12 +132,112 @@ class EmailChoicePayload(TypedDict, total=True):
     choice: int
 
 
+class EmailIdPayload(TypedDict, total=True):
+    """Payload pour désigner un courriel par son identifiant."""
+    email_id: str
+
+
+class EmailDeletionPayload(TypedDict, total=False):
+    """
+    Payload pour la suppression d'un courriel, désigné par son
+    identifiant ou, à défaut, par son numéro dans la boîte.
+    """
+    email_id: str
+    choice: int
+
+
+class SyncPayload(TypedDict, total=True):
+    """
+    Payload pour la synchronisation de la boîte: `since` est le curseur
+    retourné par la synchronisation précédente (vide la première fois).
+    """
+    since: str
+
+
+class EmailSummary(TypedDict, total=True):
+    """Entête d'un courriel transmis lors d'une synchronisation."""
+    email_id: str
+    sender: str
+    subject: str
+    date: str
+
+
+class SyncResultPayload(TypedDict, total=True):
+    """
+    Payload pour le résultat d'une synchronisation: les entêtes des
+    courriels reçus depuis `since`, du plus récent au plus ancien, les
+    identifiants des courriels supprimés depuis et le nouveau curseur.
+    Si `reset` est vrai, `added` contient toute la boîte et le client
+    oublie les autres courriels de son cache.
+    """
+    cursor: str
+    added: list[EmailSummary]
+    deleted: list[str]
+    reset: bool
+
+
 class StatsPayload(TypedDict, total=True):
     """Payload pour les statistiques."""
     count: int
     size: int
 
 
+class NewMailPayload(TypedDict, total=True):
+    """Payload pour les notifications de nouveau courriel."""
+    sender: str
+    subject: str
+    date: str
+
+
+class SearchPayload(TypedDict, total=False):
+    """
+    Payload pour la recherche de courriels. Les critères fournis
+    sont combinés; les dates sont au format AAAA-MM-JJ.
+    """
+    sender: str
+    subject: str
+    terms: str
+    date_from: str
+    date_to: str
+    page: int
+
+
+class SearchResultPayload(TypedDict, total=True):
+    """Payload pour une page de résultats de recherche."""
+    email_list: list[str]
+    page: int
+    page_count: int
+
+
+class ReplicationPositionPayload(TypedDict, total=True):
+    """
+    Payload pour une position de réplication: l'époque du journal du
+    primaire et le dernier numéro de séquence appliqué (-1 si aucun).
+    """
+    epoch: str
+    seq: int
+
+
+class ReplicationHelloPayload(TypedDict, total=True):
+    """
+    Payload pour l'ouverture du flux de réplication: la position du
+    primaire et le secret partagé qui l'authentifie auprès de la relève.
+    """
+    epoch: str
+    seq: int
+    secret: str
+
+
+class ReplicationBatchPayload(TypedDict, total=True):
+    """
+    Payload pour un lot de mutations répliquées. `seq` est la position
+    atteinte une fois le lot appliqué, ou -1 pour un lot d'instantané.
+    """
+    epoch: str
+    seq: int
+    ops: list
+
+
 class GloMessage(TypedDict, total=False):
     """
     Classe à utiliser pour générer des messages.
@@ -101,7 +247,11 @@ class GloMessage(TypedDict, total=False):
     """
     header: Headers
     payload: Union[ErrorPayload, AuthPayload, EmailContentPayload,
-                   EmailListPayload, EmailChoicePayload, StatsPayload]
+                   EmailListPayload, EmailChoicePayload, StatsPayload,
+                   NewMailPayload, SearchPayload, SearchResultPayload,
+                   EmailIdPayload, EmailDeletionPayload, SyncPayload,
+                   SyncResultPayload, ReplicationPositionPayload,
+                   ReplicationBatchPayload]
 
 
 def get_current_utc_time() -> str:
@@ -0,0 +1,456 @@
+"""\
+Micro-bancs d'essai du serveur.
+
+Usage: python tp4bench.py [dispatch] [search] [limits] [storage] [broadcast] [tls]
+                          [replication]
+
+Chaque banc s'exécute dans un dossier temporaire et n'utilise
+pas le port du serveur.
+"""
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess  # nosec:B404
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Callable
+
+import glosocket
+import gloutils
+
+
+def _measure(label: str, operation: Callable[[], None],
+             iterations: int) -> None:
+    for _ in range(min(1000, iterations)):
+        operation()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        operation()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / iterations * 1e6:10.2f} µs/op")
+
+
+def _make_server():
+    os.environ.setdefault("GLO_METRICS_PORT", "0")
+    os.environ.setdefault("GLO_LOG_LEVEL", "WARNING")
+    # Limiteurs actifs, mais sans jamais refuser de requête.
+    os.environ.setdefault("GLO_CONNECTION_RATE_LIMIT", "1e9/1e9")
+    os.environ.setdefault("GLO_USER_RATE_LIMIT", "1e9/1e9")
+    from TP4_server import Server
+    return Server(port=0)
+
+
+def bench_dispatch(iterations: int = 50000) -> None:
+    """
+    Coût par requête de `_handle_packet`, hors accès disque et hors
+    socket: les réponses sont sérialisées mais pas transmises.
+    """
+    server = _make_server()
+    served, peer = socket.socketpair()
+    server._queue_packet = lambda client, message: json.dumps(message)
+
+    unknown = json.dumps({"header": 999})
+    anonymous = json.dumps({"header": gloutils.Headers.STATS_REQUEST})
+    logout = json.dumps({"header": gloutils.Headers.AUTH_LOGOUT})
+    invalid = json.dumps({"header": gloutils.Headers.AUTH_LOGIN,
+                          "payload": {"username": 3}})
+
+    def run_unknown() -> None:
+        server._handle_packet(served, unknown)
+
+    def run_anonymous() -> None:
+        server._handle_packet(served, anonymous)
+
+    def run_logout() -> None:
+        server._logged_users[served] = "bench"
+        server._handle_packet(served, logout)
+
+    def run_invalid() -> None:
+        server._handle_packet(served, invalid)
+
+    _measure("dispatch: unknown header", run_unknown, iterations)
+    _measure("dispatch: unauthenticated request", run_anonymous, iterations)
+    _measure("dispatch: AUTH_LOGOUT", run_logout, iterations)
+    _measure("dispatch: invalid payload", run_invalid, iterations)
+    _measure("validate username + password",
+             lambda: (server._validate_username("alice.b-2")
+                      and server._validate_password_content("Password123")),
+             iterations)
+    served.close()
+    peer.close()
+    server.cleanup()
+
+
+def bench_search(size: int = 100000) -> None:
+    """Recherche dans un index de `size` courriels synthétiques."""
+    import gloindex
+    index = gloindex.MailboxIndex()
+    start = time.perf_counter()
+    for number in range(size):
+        index.add(str(number), {
+            "sender": f"user{number % 500}@{gloutils.SERVER_DOMAIN}",
+            "subject": f"Sujet {number % 1000} rapport",
+            "date": f"Mon, {1 + number % 28:02d} Jan 2024 10:00:00 +0000",
+            "content": f"contenu numero {number} terme{number % 97}"
+        }, float(number))
+    print(f"{'search: index build':<40} {time.perf_counter() - start:10.2f} s "
+          f"({size} courriels)")
+    _measure("search: sender + body term",
+             lambda: index.page(index.search(sender="user7", terms="terme7"),
+                                1, gloutils.SEARCH_PAGE_SIZE), 200)
+    _measure("search: rare subject term",
+             lambda: index.page(index.search(subject="sujet 42"),
+                                1, gloutils.SEARCH_PAGE_SIZE), 200)
+    day = gloindex.parse_search_day("2024-01-03")
+    _measure("search: date range + term",
+             lambda: index.page(index.search(terms="terme3", date_from=day,
+                                             date_to=day + 86399),
+                                1, gloutils.SEARCH_PAGE_SIZE), 200)
+
+
+def bench_limits(iterations: int = 200000) -> None:
+    """Coût des limiteurs de débit appliqués à chaque requête."""
+    import glolimits
+    bucket = glolimits.TokenBucket(1e9, 1e9)
+    limiter = glolimits.RateLimiter(1e9, 1e9)
+    disabled = glolimits.RateLimiter(0, 0)
+    _measure("limits: TokenBucket.consume",
+             lambda: bucket.consume(time.monotonic()), iterations)
+    _measure("limits: RateLimiter.allow",
+             lambda: limiter.allow("bench", time.monotonic()), iterations)
+    _measure("limits: RateLimiter.allow (désactivé)",
+             lambda: disabled.allow("bench", time.monotonic()), iterations)
+
+
+def bench_storage(user_counts: tuple[int, ...] = (1000, 10000, 50000)) -> None:
+    """
+    Recherche de compte, livraison et énumération du dossier racine selon
+    le nombre de comptes, pour la disposition à plat et la disposition
+    répartie par hachage.
+    """
+    import glostorage
+    payload = json.dumps({"content": "x" * 200}).encode("utf-8")
+    for count in user_counts:
+        flat_root = os.path.abspath(f"flat-{count}")
+        storage = glostorage.Storage(os.path.abspath(f"sharded-{count}"))
+        storage.validate()
+        os.makedirs(flat_root)
+        names = [f"user{number}" for number in range(count)]
+        for name in names:
+            os.mkdir(os.path.join(flat_root, name))
+            storage.create_user(name)
+
+        def flat_lookup(name: str = names[count // 2]) -> None:
+            os.path.isdir(os.path.join(flat_root, name))
+
+        def flat_deliver(name: str = names[count // 2]) -> None:
+            with open(os.path.join(flat_root, name,
+                                   f"{time.time_ns()}.json"), "wb") as file:
+                file.write(payload)
+
+        def sharded_deliver(name: str = names[count // 2]) -> None:
+            storage.write(storage.email_path(name, storage.new_email_id()),
+                          payload)
+
+        _measure(f"storage[{count}]: flat lookup", flat_lookup, 20000)
+        _measure(f"storage[{count}]: sharded lookup",
+                 lambda: storage.has_user(names[count // 2]), 20000)
+        _measure(f"storage[{count}]: flat delivery", flat_deliver, 2000)
+        _measure(f"storage[{count}]: sharded delivery", sharded_deliver, 2000)
+        _measure(f"storage[{count}]: flat root listdir",
+                 lambda: os.listdir(flat_root), 20)
+        _measure(f"storage[{count}]: sharded root listdir",
+                 lambda: os.listdir(storage.users_root), 20)
+
+
+def _disk_usage(root: str) -> int:
+    """Octets occupés sous `root`, chaque inode n'étant compté qu'une fois."""
+    inodes = {}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            info = os.lstat(os.path.join(directory, name))
+            inodes[info.st_ino] = info.st_blocks * 512
+    return sum(inodes.values())
+
+
+def bench_broadcast(recipients: int = 200, body_size: int = 256 * 1024) -> None:
+    """
+    Livraison d'un même corps à `recipients` comptes, en copie complète
+    par destinataire puis avec les corps partagés par condensé.
+    """
+    import glostorage
+    payload = {"sender": f"news@{gloutils.SERVER_DOMAIN}", "subject": "Infolettre",
+               "date": gloutils.get_current_utc_time(), "content": "x" * body_size}
+    copies = glostorage.Storage(os.path.abspath("copies"))
+    shared = glostorage.Storage(os.path.abspath("shared"))
+    names = [f"user{number}" for number in range(recipients)]
+    for storage in (copies, shared):
+        storage.validate()
+        for name in names:
+            storage.create_user(name)
+
+    for label, storage, deliver in (
+            ("copies", copies, lambda path, data, email:
+                copies.write(path, data)),
+            ("shared", shared, lambda path, data, email:
+                shared.write_email(path, email, len(data)))):
+        start = time.perf_counter()
+        for name in names:
+            email = dict(payload, destination=f"{name}@{gloutils.SERVER_DOMAIN}")
+            deliver(storage.email_path(name, storage.new_email_id()),
+                    json.dumps(email).encode("utf-8"), email)
+        elapsed = time.perf_counter() - start
+        print(f"{'broadcast: ' + label:<40} {elapsed / recipients * 1e6:10.2f} µs/op"
+              f"  {_disk_usage(storage.root) / 2**20:8.1f} Mio")
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _spawn_server(env: dict) -> tuple[subprocess.Popen, int]:
+    """Lance TP4_server.py dans un processus à part et attend qu'il écoute."""
+    port = _free_port()
+    server_env = dict(os.environ, GLO_PORT=str(port), GLO_METRICS_PORT="0",
+                      GLO_LOG_LEVEL="WARNING", GLO_CONNECTION_RATE_LIMIT="0",
+                      GLO_USER_RATE_LIMIT="0")
+    server_env.update(env)
+    server = subprocess.Popen(  # nosec:B603
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                      "TP4_server.py")], env=server_env)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return server, port
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("le serveur n'a pas démarré")
+
+
+def _process_cpu(pid: int) -> float:
+    """Temps CPU consommé par le processus `pid`, en secondes (Linux)."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as file:
+            fields = file.read().rpartition(")")[2].split()
+    except OSError:
+        return float("nan")
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def bench_tls(connections: int = 500, requests: int = 5000) -> None:
+    """
+    Établissement de connexion (poignée de main et une requête) et
+    coût par requête, en clair puis en TLS avec et sans reprise de
+    session, pour un certificat RSA et un certificat ECDSA générés
+    localement avec `openssl`. Le temps CPU du serveur par connexion
+    est mesuré à part, puisque c'est lui qui limite un serveur à un
+    seul cœur.
+    """
+    import glotls
+    if shutil.which("openssl") is None:
+        print("tls: openssl introuvable, banc ignoré")
+        return
+    request = json.dumps({"header": gloutils.Headers.STATS_REQUEST})
+
+    def exchange(client_soc: socket.socket) -> None:
+        glosocket.send_mesg(client_soc, request)
+        glosocket.recv_mesg(client_soc)
+
+    def measure_setup(label: str, server: subprocess.Popen,
+                      connect: Callable[[], socket.socket],
+                      before_close: Callable[[socket.socket], None] = lambda _: None
+                      ) -> None:
+        cpu = _process_cpu(server.pid)
+        start = time.perf_counter()
+        for _ in range(connections):
+            client_soc = connect()
+            exchange(client_soc)
+            before_close(client_soc)
+            client_soc.close()
+        elapsed = time.perf_counter() - start
+        cpu = _process_cpu(server.pid) - cpu
+        print(f"{'tls: connect, ' + label:<40} {connections / elapsed:10.0f} conn/s"
+              f"  {cpu / connections * 1e6:8.0f} µs CPU serveur/conn")
+
+    def measure_requests(label: str, client_soc: socket.socket) -> None:
+        _measure(f"tls: request, {label}", lambda: exchange(client_soc), requests)
+        client_soc.close()
+
+    plain, plain_port = _spawn_server({})
+    try:
+        measure_setup("plaintext", plain,
+                      lambda: socket.create_connection(("127.0.0.1", plain_port)))
+        measure_requests("plaintext",
+                         socket.create_connection(("127.0.0.1", plain_port)))
+    finally:
+        plain.terminate()
+        plain.wait()
+
+    for name, key in (("RSA", ["rsa:2048"]),
+                      ("ECDSA", ["ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"])):
+        subprocess.run(  # nosec:B603,B607
+            ["openssl", "req", "-x509", "-newkey", *key, "-nodes", "-days", "1",
+             "-subj", "/CN=localhost",
+             "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+             "-keyout", f"{name}.key", "-out", f"{name}.pem"],
+            check=True, capture_output=True)
+        secure, port = _spawn_server({"GLO_TLS_CERT": f"{name}.pem",
+                                      "GLO_TLS_KEY": f"{name}.key"})
+        context = glotls.client_context(f"{name}.pem")
+        connector = glotls.TLSConnector(context)
+        resumed = []
+
+        def keep_session(client_soc: socket.socket) -> None:
+            resumed.append(client_soc.session_reused)
+            connector.remember(client_soc, "localhost", port)
+
+        def connect_full() -> socket.socket:
+            return context.wrap_socket(
+                socket.create_connection(("127.0.0.1", port)),
+                server_hostname="localhost")
+
+        def connect_resumed() -> socket.socket:
+            return connector.wrap(
+                socket.create_connection(("127.0.0.1", port)), "localhost", port)
+
+        try:
+            measure_setup(f"TLS {name} full handshake", secure, connect_full)
+            measure_setup(f"TLS {name} resumed session", secure, connect_resumed,
+                          keep_session)
+            print(f"{'tls: sessions resumed':<40} {sum(resumed):10d} / {len(resumed)}")
+            measure_requests(f"TLS {name}", connect_full())
+        finally:
+            secure.terminate()
+            secure.wait()
+
+
+def _request(client_soc: socket.socket, header: gloutils.Headers,
+             payload: dict = None) -> dict:
+    message = {"header": header}
+    if payload is not None:
+        message["payload"] = payload
+    glosocket.send_mesg(client_soc, json.dumps(message))
+    return json.loads(glosocket.recv_mesg(client_soc))
+
+
+def _server_pids(port: int) -> list[int]:
+    """Processus serveurs lancés sur `port`, remplaçants compris (Linux)."""
+    pids = []
+    for pid in os.listdir("/proc"):
+        try:
+            with open(f"/proc/{pid}/environ", "rb") as file:
+                if f"GLO_PORT={port}".encode("ascii") in file.read().split(b"\0"):
+                    pids.append(int(pid))
+        except (OSError, ValueError):
+            continue
+    return pids
+
+
+def bench_replication(emails: int = 500) -> None:
+    """
+    Vérification à deux instances locales: délai de convergence d'une
+    relève après une rafale de livraisons sur le primaire, puis
+    rechargement (SIGHUP) du primaire. Après le rechargement, la relève
+    ne doit recevoir que les nouvelles mutations, sans instantané; le
+    banc échoue sinon.
+    """
+    import gloreplication
+    import glostorage
+    secret = {"GLO_REPLICATION_SECRET": "banc", "GLO_QUOTA_BYTES": "0"}
+    metrics_port = _free_port()
+    standby, standby_port = _spawn_server(dict(
+        secret, GLO_ROLE="standby", GLO_DATA_DIR=os.path.abspath("standby"),
+        GLO_METRICS_PORT=str(metrics_port)))
+    primary, port = _spawn_server(dict(
+        secret, GLO_REPLICAS=f"127.0.0.1:{standby_port}",
+        GLO_DATA_DIR=os.path.abspath("primary")))
+    position_path = os.path.join("standby", glostorage.REPLICATION_FILENAME)
+    account = {"username": "banc", "password": "Banc123456"}
+    email = {"sender": f"banc@{gloutils.SERVER_DOMAIN}",
+             "destination": f"banc@{gloutils.SERVER_DOMAIN}",
+             "subject": "Réplication", "date": gloutils.get_current_utc_time(),
+             "content": "contenu"}
+
+    def applied() -> int:
+        with urllib.request.urlopen(
+                f"http://127.0.0.1:{metrics_port}/metrics", timeout=5) as response:
+            for line in response.read().decode("utf-8").splitlines():
+                if line.startswith("glo_replication_applied_total "):
+                    return int(float(line.split()[1]))
+        return 0
+
+    def converge(label: str, expected: int) -> None:
+        start = time.perf_counter()
+        for _ in range(emails):
+            reply = _request(writer, gloutils.Headers.EMAIL_SENDING, email)
+            if reply["header"] != gloutils.Headers.OK:
+                raise RuntimeError(f"replication: envoi refusé {reply['payload']}")
+        sent = time.perf_counter()
+        while _request(reader, gloutils.Headers.STATS_REQUEST)["payload"]["count"] \
+                < expected:
+            if time.perf_counter() - sent > 10:
+                raise RuntimeError(f"replication: la relève n'a pas convergé ({label})")
+            time.sleep(0.001)
+        done = time.perf_counter()
+        print(f"{'replication: ' + label:<40} {emails / (sent - start):10.0f} env/s"
+              f"  convergence {(done - sent) * 1e3:6.1f} ms")
+
+    try:
+        writer = socket.create_connection(("127.0.0.1", port))
+        _request(writer, gloutils.Headers.AUTH_REGISTER, account)
+        time.sleep(gloutils.REPLICATION_FLUSH_INTERVAL * 4)
+        reader = socket.create_connection(("127.0.0.1", standby_port))
+        if _request(reader, gloutils.Headers.AUTH_LOGIN, account)["header"] \
+                != gloutils.Headers.OK:
+            raise RuntimeError("replication: compte absent de la relève")
+        converge("burst", emails)
+        epoch, _ = gloreplication.load_position(position_path)
+        before = applied()
+
+        primary.send_signal(signal.SIGHUP)
+        primary.wait(timeout=gloutils.HANDOFF_TIMEOUT)
+        converge("after reload", emails * 2)
+        reloaded_epoch, _ = gloreplication.load_position(position_path)
+        replayed = applied() - before
+        print(f"{'replication: ops applied after reload':<40} {replayed:10d}"
+              f"  (attendu {emails})")
+        if reloaded_epoch != epoch or replayed != emails:
+            raise RuntimeError("replication: instantané complet après le rechargement")
+    finally:
+        for pid in _server_pids(port):
+            os.kill(pid, signal.SIGTERM)
+        standby.terminate()
+        standby.wait()
+        primary.wait()
+
+
+BENCHES = {
+    "dispatch": bench_dispatch,
+    "search": bench_search,
+    "limits": bench_limits,
+    "storage": bench_storage,
+    "broadcast": bench_broadcast,
+    "tls": bench_tls,
+    "replication": bench_replication,
+}
+
+
+def _main() -> int:
+    selected = sys.argv[1:] or list(BENCHES)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        for name in selected:
+            BENCHES[name]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())